@@ -0,0 +1,56 @@
+# achievements.py — досягнення: каталог і отримані коди в пам'яті, правила за подіями з обробників
+
+import sqlite3
+
+from cache import TTLCache, MISSING
+from database import Database
+
+# (подія, код, умова від значення події). Нове досягнення — рядок у каталозі (міграцією) і правило тут;
+# запитів у гарячих обробниках від цього не додається
+RULES = (
+    ("note", "FIRST_NOTE", lambda _: True),
+    ("report", "FIRST_REPORT", lambda _: True),
+    ("checkin", "STREAK_5_DAYS", lambda streak: streak >= 5),
+)
+
+
+def _unlock(conn: sqlite3.Connection, user_id: int, codes) -> list:
+    # OR IGNORE: досягнення, що вже є в базі (застарілий кеш), не повідомляється вдруге
+    sql = "INSERT OR IGNORE INTO user_achievements (user_id, achievement_code) VALUES (?, ?)"
+    return [code for code in codes if conn.execute(sql, (user_id, code)).rowcount]
+
+
+class AchievementEngine:
+    """Перевірка досягнень без звернень до БД у звичайному випадку.
+
+    Каталог читається один раз, отримані коди активних користувачів тримаються в LRU-кеші.
+    Запит до БД буває лише при першій події користувача, умова якої виконалась, і при самому отриманні.
+    З кількома воркерами користувач завжди обробляється тим самим процесом (sharding), тож кеш не розходиться з базою.
+    """
+
+    def __init__(self, db: Database, rules=RULES, maxsize: int = 20000, ttl: float = 6 * 3600):
+        self.db = db
+        self.catalog = None
+        self._rules = {}
+        for event, code, condition in rules: self._rules.setdefault(event, []).append((code, condition))
+        self._unlocked = TTLCache(maxsize, ttl)
+
+    async def load(self):
+        self.catalog = {code: (name, icon) for code, name, icon in await self.db.fetchall("SELECT code, name, icon FROM achievements")}
+
+    async def unlocked(self, user_id: int) -> set:
+        if (codes := self._unlocked.get(user_id)) is MISSING:
+            codes = {row[0] for row in await self.db.fetchall("SELECT achievement_code FROM user_achievements WHERE user_id = ?", (user_id,))}
+            self._unlocked.set(user_id, codes)
+        return codes
+
+    async def emit(self, user_id: int, event: str, value=None) -> list:
+        """Обробляє подію і повертає (name, icon) щойно отриманих досягнень."""
+        if self.catalog is None: await self.load()
+        candidates = [code for code, condition in self._rules.get(event, ()) if code in self.catalog and condition(value)]
+        if not candidates: return []
+        unlocked = await self.unlocked(user_id)
+        if not (new := [code for code in candidates if code not in unlocked]): return []
+        inserted = await self.db.run(_unlock, user_id, new, write=True)
+        unlocked.update(new)
+        return [self.catalog[code] for code in inserted]
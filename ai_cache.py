@@ -0,0 +1,100 @@
+# ai_cache.py — кеш відповідей AI та об'єднання однакових запитів
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+
+from ai_client import AIBusyError
+from database import Database
+
+AI_CACHE_TTL = 7 * 24 * 3600
+AI_CACHE_MAX_ENTRIES = 5000
+# Як часто (у кількості нових записів) прибирати прострочені й зайві рядки
+EVICT_EVERY = 100
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS ai_response_cache (cache_key TEXT PRIMARY KEY, response TEXT, created_at INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_response_cache_created ON ai_response_cache (created_at)")
+
+
+def _normalize(text) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().strip(".!").lower()
+
+
+def age_bucket(age) -> str:
+    try: age = int(float(age))
+    except (TypeError, ValueError): return "n/a"
+    for limit, bucket in ((18, "<18"), (30, "18-29"), (45, "30-44"), (60, "45-59")):
+        if age < limit: return bucket
+    return "60+"
+
+
+def make_key(model: str, system_prompt: str, symptoms: str, age=None, gender=None, allergies=None, chronic=None) -> str:
+    """Ключ кешу: модель, системний промпт, нормалізовані скарги і лише ті поля профілю, що впливають на аналіз."""
+    parts = [model, system_prompt, _normalize(symptoms), age_bucket(age), _normalize(gender), _normalize(allergies), _normalize(chronic)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class AIResponseCache:
+    """Персистентний кеш відповідей з TTL і обмеженням розміру + single-flight.
+
+    Однакові запити, що виконуються одночасно, чекають на один виклик factory().
+    Помилки не кешуються. Спільними є лише результат і помилки моделі: якщо ведучий запит скасовано
+    або він уперся у власний ліміт користувача (AIBusyError), очікувач сам стає ведучим.
+    """
+
+    def __init__(self, db: Database, ttl: int = AI_CACHE_TTL, max_entries: int = AI_CACHE_MAX_ENTRIES):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = self.misses = self.coalesced = 0
+        self._inflight = {}
+        self._stores = 0
+
+    async def get_or_create(self, key: str, factory):
+        while (future := self._inflight.get(key)) is not None:
+            self.coalesced += 1
+            await asyncio.wait((future,))  # не скасовує future, а власне скасування очікувача пропускає
+            if not future.cancelled() and not isinstance(future.exception(), AIBusyError): return future.result()
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            row = await self.db.fetchone("SELECT response FROM ai_response_cache WHERE cache_key = ? AND created_at > ?", (key, int(time.time()) - self.ttl))
+            if row:
+                self.hits += 1
+                result = row[0]
+            else:
+                self.misses += 1
+                result = await factory()
+                await self._store(key, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # позначаємо виняток як отриманий, навіть якщо ніхто не чекав
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _store(self, key: str, response: str):
+        try:
+            await self.db.execute("INSERT OR REPLACE INTO ai_response_cache (cache_key, response, created_at) VALUES (?, ?, ?)", (key, response, int(time.time())))
+            self._stores += 1
+            if self._stores % EVICT_EVERY == 0: await self.db.run(self._evict, write=True)
+        except Exception:
+            logging.exception("Не вдалося зберегти відповідь AI в кеш:")
+
+    def _evict(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM ai_response_cache WHERE created_at <= ?", (int(time.time()) - self.ttl,))
+        conn.execute("DELETE FROM ai_response_cache WHERE cache_key IN (SELECT cache_key FROM ai_response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
@@ -0,0 +1,110 @@
+# ai_client.py — обгортка над OpenRouter-клієнтом: ліміти, таймаути, повтори, circuit breaker
+
+import asyncio
+import functools
+import logging
+import random
+import time
+
+
+@functools.cache
+def retryable_errors() -> tuple:
+    """Помилки, які має сенс повторити (мережа, таймаут, перевантаження або збій на боці провайдера)."""
+    # openai імпортується лише при першому запиті до AI, а не під час старту бота
+    import openai
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError, asyncio.TimeoutError)
+
+
+class AIUnavailableError(Exception):
+    """AI тимчасово недоступний (відкритий circuit breaker або вичерпано повтори)."""
+
+
+class AIBusyError(Exception):
+    """У користувача вже виконується максимальна кількість запитів до AI."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        if self.opened_at is None: return True
+        if self.is_open: return False
+        self.opened_at = time.monotonic()  # напіввідкритий стан: одна пробна спроба на вікно
+        return True
+
+    def success(self):
+        self.failures, self.opened_at = 0, None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None: logging.warning(f"AI circuit breaker відкрито після {self.failures} помилок поспіль")
+            self.opened_at = time.monotonic()
+
+
+class ResilientAIClient:
+    """Обмежує і захищає запити до моделі.
+
+    run(user_id, request) викликає request(model) — корутину, що виконує весь запит
+    (разом зі споживанням потоку), з глобальним семафором, лімітом на користувача,
+    дедлайном на спробу, повторами з джитером і резервною моделлю для останньої спроби.
+    Клієнт (AsyncOpenAI) створюється client_factory() при першому зверненні до .client.
+    """
+
+    def __init__(self, client_factory, model: str, fallback_model: str = None, max_concurrency: int = 20, per_user_limit: int = 1,
+                 timeout: float = 60.0, retries: int = 2, backoff: float = 1.0, breaker: CircuitBreaker = None):
+        self.client_factory = client_factory
+        self._client = None
+        self.model = model
+        self.fallback_model = fallback_model
+        self.per_user_limit = per_user_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = {}
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    @property
+    def client(self):
+        if self._client is None: self._client = self.client_factory()
+        return self._client
+
+    async def run(self, user_id: int, request):
+        if not self.breaker.allow(): raise AIUnavailableError("circuit breaker is open")
+        if self._in_flight.get(user_id, 0) >= self.per_user_limit: raise AIBusyError()
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        try:
+            async with self._semaphore:
+                return await self._run_with_retries(request)
+        finally:
+            if (count := self._in_flight[user_id] - 1) > 0: self._in_flight[user_id] = count
+            else: del self._in_flight[user_id]
+
+    async def _run_with_retries(self, request):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            model = self.fallback_model if self.fallback_model and attempt == self.retries and attempt > 0 else self.model
+            try:
+                result = await asyncio.wait_for(request(model), self.timeout)
+                self.breaker.success()
+                return result
+            except retryable_errors() as e:
+                last_error = e
+                self.breaker.failure()
+                logging.warning(f"Запит до AI ({model}) невдалий, спроба {attempt + 1}/{self.retries + 1}: {e!r}")
+                if self.breaker.is_open or attempt == self.retries: break
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        raise AIUnavailableError(str(last_error)) from last_error
@@ -0,0 +1,330 @@
+# benchmark.py — офлайн-бенчмарк: роутер бота проти фейкових Bot API і OpenAI-сумісного сервера
+#
+# Жодних мережевих викликів назовні: обидва сервери піднімаються локально з налаштовуваною затримкою,
+# база — тимчасовий файл. Сценарії (онбординг, check-in, майстер ліків, аналіз симптомів, звіт)
+# проганяються для тисяч користувачів через dp.feed_raw_update, як це робить polling чи webhook.
+#
+#   python benchmark.py --users 2000 --concurrency 200 --api-latency 0.03 --ai-latency 0.8
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+import med_bot_aiogram as bot_module
+import metrics
+import rollups
+from ai_client import ResilientAIClient
+from fsm_storage import SQLiteStorage
+
+BOT_TOKEN = "123456:BENCHMARK-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Бенчмарк", "username": "benchmark_bot"}
+SYMPTOMS = ["Болить голова третій день", "Нежить і температура 37.5", "Болить горло, важко ковтати", "Печія після їжі",
+            "Ломить спину після тренування", "Кашель вночі", "Запаморочення зранку", "Свербить шкіра на руках"]
+MEDICATIONS = [("Вітамін D", "1 капсула", "09:00"), ("Магній", "200 mg", "21:00"), ("Омепразол", "20 mg", "08:00, 20:00")]
+
+
+async def _start_site(app: web.Application):
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def _jitter(latency: float) -> float:
+    return random.uniform(0.5, 1.5) * latency if latency else 0
+
+
+# --- Фейковий Bot API ---
+class FakeBotAPI:
+    """Відповідає на /bot<token>/<method> мінімально валідними об'єктами Telegram після затримки `latency`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    def application(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)  # PDF-звіти і PNG приходять multipart-ом
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request):
+        method, data = request.match_info["method"], await request.post()
+        self.calls[method] += 1
+        if self.latency: await asyncio.sleep(_jitter(self.latency))
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+    def _result(self, method: str, data):
+        if method == "getMe": return BOT_USER
+        if method.startswith(("send", "edit")):
+            chat_id = int(data.get("chat_id", 0))
+            return {"message_id": int(data.get("message_id") or next(self._message_ids)), "date": int(time.time()), "from": BOT_USER,
+                    "chat": {"id": chat_id, "type": "private"}, "text": data.get("text") or data.get("caption") or ""}
+        return True
+
+
+# --- Фейковий OpenAI-сумісний сервер ---
+class FakeAI:
+    """/v1/chat/completions: затримка до першого токена `latency`, далі шматки по `chunk_delay` (при stream=true).
+
+    Частка `clarify_ratio` первинних запитів отримує коротке уточнююче питання — так проганяється і цикл уточнень.
+    """
+
+    ANSWER = ("Ви скаржитесь на неприємні симптоми. Найчастіше це буває через втому, застуду або зневоднення. "
+              "Можливі причини: вірусна інфекція, перенапруження, порушення сну. Рекомендую більше відпочивати і пити воду.\n\n"
+              "<b>Можливі напрямки лікування, які варто обговорити з лікарем:</b> симптоматична терапія, корекція режиму.\n\n") * 3 + \
+             "Пам'ятайте, цей аналіз не є діагнозом. Для точної діагностики зверніться до лікаря."
+    QUESTION = "Чи є у вас підвищена температура?"
+
+    def __init__(self, latency: float = 0.5, chunk_delay: float = 0.01, chunk_size: int = 24, clarify_ratio: float = 0.2):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.clarify_ratio = clarify_ratio
+        self.requests = 0
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        return app
+
+    def _answer(self, messages) -> str:
+        if not any(message["role"] == "assistant" for message in messages or ()) and random.random() < self.clarify_ratio: return self.QUESTION
+        return self.ANSWER
+
+    async def handle(self, request: web.Request):
+        body = await request.json()
+        self.requests += 1
+        text, model = self._answer(body.get("messages")), body.get("model", "fake")
+        if self.latency: await asyncio.sleep(_jitter(self.latency))
+        if not body.get("stream"):
+            return web.json_response({"id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                                      "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                                      "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for offset in range(0, len(text), self.chunk_size):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": {"content": text[offset:offset + self.chunk_size]}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if self.chunk_delay: await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def serve_fakes(conn, api_latency: float, ai_latency: float, ai_chunk_delay: float, clarify_ratio: float):
+    """Обидва фейкові сервери в окремому процесі, щоб їхня робота не ділила event loop і GIL з ботом."""
+    asyncio.run(_serve_fakes(conn, FakeBotAPI(api_latency), FakeAI(ai_latency, ai_chunk_delay, clarify_ratio=clarify_ratio)))
+
+async def _serve_fakes(conn, fake_api: FakeBotAPI, fake_ai: FakeAI):
+    api_runner, api_url = await _start_site(fake_api.application())
+    ai_runner, ai_url = await _start_site(fake_ai.application())
+    conn.send((api_url, ai_url))
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)  # будь-яке повідомлення — сигнал зупинки
+    conn.send((dict(fake_api.calls), fake_ai.requests))
+    await api_runner.cleanup(), await ai_runner.cleanup()
+
+
+# --- Сценарії користувачів ---
+class Session:
+    """Скриптова сесія одного користувача: кожен крок — одне оновлення, що проходить увесь диспетчер."""
+
+    _update_ids = itertools.count(1)
+    _message_ids = itertools.count(1_000_000)
+
+    def __init__(self, bench: "Benchmark", user_id: int):
+        self.bench = bench
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "uk"}
+        self.chat = {"id": user_id, "type": "private", "first_name": self.user["first_name"]}
+
+    async def text(self, step: str, text: str):
+        await self.bench.feed(step, {"update_id": next(self._update_ids), "message": {"message_id": next(self._message_ids), "date": int(time.time()),
+                                                                                      "chat": self.chat, "from": self.user, "text": text}})
+
+    async def callback(self, step: str, data: str):
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": self.chat, "from": BOT_USER, "text": "..."}
+        await self.bench.feed(step, {"update_id": next(self._update_ids), "callback_query": {"id": str(next(self._update_ids)), "from": self.user,
+                                                                                             "chat_instance": "benchmark", "data": data, "message": message}})
+
+    async def state(self):
+        return await self.bench.dp.fsm.get_context(self.bench.bot, self.user["id"], self.user["id"]).get_state()
+
+    async def onboarding(self):
+        await self.text("start", "/start")
+        await self.callback("privacy", "accept_privacy")
+
+    async def checkin(self):
+        await self.text("checkin", "☀️ Щоденний Check-in")
+        await self.text("checkin_mood", random.choice(rollups.CATEGORIES["mood"]))
+        await self.text("checkin_sleep", f"{random.randint(5, 9)} годин, добре")
+        for metric in ("activity_level", "stress_level", "water_intake"):
+            await self.text(f"checkin_{metric.split('_')[0]}", random.choice(rollups.CATEGORIES[metric]))
+
+    async def medication_wizard(self):
+        name, dosage, schedule = random.choice(MEDICATIONS)
+        await self.text("meds_menu", "💊 Мої ліки")
+        await self.callback("med_add", "add_medication")
+        await self.text("med_name", name)
+        await self.text("med_dosage", dosage)
+        await self.text("med_schedule", schedule)
+
+    async def symptom_analysis(self):
+        await self.text("symptoms_menu", bot_module.ANALYZE_BTN_TEXT)
+        await self.callback("symptom_other", "symptom:other")
+        # Тривалість урізноманітнює скарги: частина запитів іде в кеш відповідей AI, частина — до моделі
+        await self.text("symptom_text", f"{random.choice(SYMPTOMS)}, вже {random.randint(1, 14)} дн.")
+        if await self.state() == bot_module.Form.answering_clarification.state:
+            await self.text("symptom_clarification", random.choice(["Так, 37.8", "Ні, температури немає"]))
+
+    async def report(self):
+        await self.text("report", "📄 Створити звіт")
+
+
+# --- Прогін ---
+def percentile(values, q: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.db_calls = []
+        self.errors = Counter()
+        self.bot = self.dp = None
+
+    async def feed(self, step: str, update: dict):
+        started = time.perf_counter()
+        try: await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            self.errors[f"{step}: {type(e).__name__}"] += 1
+            if sum(self.errors.values()) == 1: logging.exception(f"Помилка обробки кроку {step}:")
+        finally: self.latencies[step].append(time.perf_counter() - started)
+        if self.args.think_time: await asyncio.sleep(random.uniform(0, 2 * self.args.think_time))
+
+    async def run_session(self, user_id: int, semaphore: asyncio.Semaphore):
+        session = Session(self, user_id)
+        async with semaphore:
+            await session.onboarding()
+            await session.checkin()
+            if random.random() < self.args.med_ratio: await session.medication_wizard()
+            if random.random() < self.args.symptom_ratio: await session.symptom_analysis()
+            if random.random() < self.args.report_ratio: await session.report()
+
+    def _on_db_call(self, function: str, write: bool, seconds: float):
+        self.db_calls.append(seconds)  # list.append атомарний — хук викликається з потоків БД
+        metrics.observe_db_call(function, write, seconds)
+
+    async def run(self):
+        args = self.args
+        conn, child_conn = multiprocessing.Pipe()
+        fakes = multiprocessing.get_context("spawn").Process(target=serve_fakes, args=(child_conn, args.api_latency, args.ai_latency, args.ai_chunk_delay, args.clarify_ratio), daemon=True)
+        fakes.start()
+        api_url, ai_url = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        workdir = tempfile.mkdtemp(prefix="med-bot-bench-")
+        # База створюється ліниво при першому з'єднанні, тож шлях можна підмінити до on_startup
+        bot_module.db.path = os.path.join(workdir, "benchmark.db")
+        bot_module.db.on_call = self._on_db_call
+        bot_module.AI_STREAMING = not args.no_stream
+        bot_module.PREWARM = args.report_ratio > 0
+
+        def create_openai_client():
+            from openai import AsyncOpenAI
+            return AsyncOpenAI(api_key="benchmark", base_url=f"{ai_url}/v1", max_retries=0)
+
+        self.bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url), limit=args.concurrency),
+                       default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.dp = Dispatcher(storage=SQLiteStorage(bot_module.db))
+        self.dp.include_router(bot_module.router)
+        self.dp.startup.register(bot_module.on_startup)
+        self.dp.shutdown.register(bot_module.on_shutdown)
+        self.dp["ai_client"] = ResilientAIClient(create_openai_client, model=bot_module.AI_MODEL, max_concurrency=args.ai_concurrency, timeout=60)
+        try:
+            await self.dp.emit_startup(bot=self.bot)
+            semaphore = asyncio.Semaphore(args.concurrency)
+            print(f"Прогін: {args.users} користувачів, паралельно {args.concurrency}, Bot API {args.api_latency * 1000:.0f} мс, AI {args.ai_latency * 1000:.0f} мс")
+            started = time.perf_counter()
+            await asyncio.gather(*(self.run_session(args.first_user_id + i, semaphore) for i in range(args.users)))
+            elapsed = time.perf_counter() - started
+            conn.send("stop")
+            api_calls, ai_requests = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+            self.report(elapsed, Counter(api_calls), ai_requests)
+            if args.metrics_out:
+                with open(args.metrics_out, "w", encoding="utf-8") as f: f.write(metrics.render())
+        finally:
+            await self.dp.emit_shutdown(bot=self.bot)
+            await self.bot.session.close()
+            fakes.terminate()
+            if args.keep_db: print(f"База збережена: {bot_module.db.path}")
+            else: shutil.rmtree(workdir, ignore_errors=True)
+
+    def report(self, elapsed: float, api_calls: Counter, ai_requests: int):
+        everything = [value for values in self.latencies.values() for value in values]
+        db_total = sum(self.db_calls)
+        print(f"\nОновлень: {len(everything)} за {elapsed:.1f} с — {len(everything) / elapsed:.0f} оновлень/с")
+        print(f"Латентність обробки: p50 {percentile(everything, 0.5) * 1000:.1f} мс, p99 {percentile(everything, 0.99) * 1000:.1f} мс, макс {max(everything) * 1000:.1f} мс")
+        print(f"БД: {len(self.db_calls)} викликів, сумарно {db_total:.2f} с ({db_total / len(everything) * 1000:.2f} мс на оновлення), "
+              f"p50 {percentile(self.db_calls, 0.5) * 1000:.2f} мс, p99 {percentile(self.db_calls, 0.99) * 1000:.2f} мс")
+        print(f"Bot API: {sum(api_calls.values())} викликів ({', '.join(f'{m} {n}' for m, n in api_calls.most_common(5))}); AI: {ai_requests} запитів")
+        print(f"\n{'крок':<24}{'кількість':>10}{'p50, мс':>10}{'p99, мс':>10}")
+        for step, values in self.latencies.items():
+            print(f"{step:<24}{len(values):>10}{percentile(values, 0.5) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}")
+        # Середній час на обробник і DB-хелпер — з тих самих гістограм, що й /metrics
+        for title, histogram in (("обробник", metrics.handler_latency), ("DB-хелпер", metrics.db_helper_latency)):
+            sums, counts = {}, {}
+            for suffix, key, value, *_ in histogram.samples():
+                if suffix == "_sum": sums[key[0]] = value
+                elif suffix == "_count": counts[key[0]] = value
+            print(f"\n{title:<32}{'викликів':>10}{'середнє, мс':>14}")
+            for name, total in sorted(sums.items(), key=lambda item: -item[1]):
+                print(f"{name:<32}{counts[name]:>10}{total / counts[name] * 1000:>14.2f}")
+        if self.errors: print(f"\nПомилки: {dict(self.errors)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк обробників бота")
+    parser.add_argument("--users", type=int, default=2000, help="кількість симульованих користувачів")
+    parser.add_argument("--concurrency", type=int, default=200, help="скільки сесій виконуються одночасно")
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    parser.add_argument("--api-latency", type=float, default=0.03, help="середня затримка Bot API, с")
+    parser.add_argument("--ai-latency", type=float, default=0.8, help="затримка AI до першого токена, с")
+    parser.add_argument("--ai-chunk-delay", type=float, default=0.01, help="пауза між шматками потокової відповіді, с")
+    parser.add_argument("--ai-concurrency", type=int, default=20, help="max_concurrency ResilientAIClient")
+    parser.add_argument("--no-stream", action="store_true", help="AI без потокового виводу")
+    parser.add_argument("--clarify-ratio", type=float, default=0.2, help="частка відповідей AI з уточнюючим питанням")
+    parser.add_argument("--med-ratio", type=float, default=0.5, help="частка користувачів, що проходять майстер ліків")
+    parser.add_argument("--symptom-ratio", type=float, default=0.3, help="частка користувачів з аналізом симптомів")
+    parser.add_argument("--report-ratio", type=float, default=0.02, help="частка користувачів, що генерують PDF-звіт")
+    parser.add_argument("--think-time", type=float, default=0.0, help="середня пауза користувача між кроками, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--metrics-out", help="записати /metrics після прогону у файл")
+    parser.add_argument("--keep-db", action="store_true", help="не видаляти тимчасову базу")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    asyncio.run(Benchmark(args).run())
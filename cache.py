@@ -0,0 +1,55 @@
+# cache.py — простий in-process кеш LRU з TTL
+
+import time
+from collections import OrderedDict
+
+# Маркер відсутнього значення (None теж може бути закешованим значенням)
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кеш з обмеженням за розміром і часом життя записів та лічильниками влучань.
+
+    generation збільшується при кожній інвалідації: значення, прочитане з БД до
+    інвалідації, не потрапить у кеш (set(..., generation=...) його відкине).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is not None and item[1] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        if item is not None: del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, generation: int = None):
+        if generation is not None and generation != self.generation: return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
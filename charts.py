@@ -0,0 +1,87 @@
+# charts.py — графіки трендів (настрій, стрес, активність, прийом ліків) для /trends і звіту лікарю
+
+import datetime
+import io
+import sqlite3
+
+import rollups
+
+TRENDS_DAYS = 365
+ROLLING_WINDOW = 7
+# Бали відповідей з клавіатури check-in: 1 — низько, 3 — високо (для настрою «Чудовий» — найвищий бал)
+SCORED_METRICS = {
+    "mood": ("Настрій", dict(zip(rollups.CATEGORIES["mood"], (3, 2, 1)))),
+    "stress_level": ("Стрес", dict(zip(rollups.CATEGORIES["stress_level"], (1, 2, 3)))),
+    "activity_level": ("Активність", dict(zip(rollups.CATEGORIES["activity_level"], (1, 2, 3)))),
+}
+
+
+def load_trend_data(conn: sqlite3.Connection, user_id: int, since: datetime.date):
+    """Денні зрізи та статистика прийому ліків за період — усе, що потрібно для рендерингу в іншому процесі."""
+    rows = conn.execute("SELECT period_start, metric, value, count FROM health_rollups WHERE user_id = ? AND period = 'day' AND period_start >= ? AND metric IN (?, ?, ?)",
+                        (user_id, since.isoformat(), *SCORED_METRICS)).fetchall()
+    meds = conn.execute("""SELECT m.med_name, SUM(l.status = 'taken'), COUNT(*) FROM medication_log l JOIN medications m ON m.med_id = l.med_id
+                           WHERE l.user_id = ? AND l.timestamp >= ? GROUP BY l.med_id ORDER BY m.med_name""", (user_id, since.isoformat())).fetchall()
+    return rows, meds
+
+
+def data_version(conn: sqlite3.Connection, user_id: int):
+    # Лічильники в зрізах лише зростають, тож їхня сума змінюється з кожним новим записом чи відміткою про ліки
+    return conn.execute("SELECT COALESCE(SUM(count), 0) FROM health_rollups WHERE user_id = ? AND period = 'week'", (user_id,)).fetchone()[0]
+
+
+def daily_scores(rows, start: datetime.date, days: int, window: int = ROLLING_WINDOW) -> dict:
+    """Ковзне середнє балів за `window` днів для кожної метрики; NaN там, де у вікні немає відповідей."""
+    if not rows: return {}
+    import numpy as np  # numpy потрібен лише процесам пулу, що рендерять графіки
+    starts, metrics, values, counts = zip(*rows)
+    day = (np.array(starts, dtype="datetime64[D]") - np.datetime64(start, "D")).astype(int)
+    metrics, values, counts = np.array(metrics), np.array(values), np.array(counts, dtype=float)
+    result = {}
+    for metric, (_, scale) in SCORED_METRICS.items():
+        score = np.select([values == option for option in scale], list(scale.values()), np.nan)
+        mask = (metrics == metric) & ~np.isnan(score) & (day >= 0) & (day < days)
+        if not mask.any(): continue
+        total = np.bincount(day[mask], weights=score[mask] * counts[mask], minlength=days)
+        answers = np.bincount(day[mask], weights=counts[mask], minlength=days)
+        # Ковзні суми через кумулятивні суми: O(days) незалежно від ширини вікна
+        total_cs, answers_cs = np.concatenate(([0.0], np.cumsum(total))), np.concatenate(([0.0], np.cumsum(answers)))
+        lag = np.maximum(np.arange(1, days + 1) - window, 0)
+        window_answers = answers_cs[1:] - answers_cs[lag]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[metric] = np.where(window_answers > 0, (total_cs[1:] - total_cs[lag]) / window_answers, np.nan)
+    return result
+
+
+def render_trends_png(rows, meds, start: datetime.date, days: int = TRENDS_DAYS) -> bytes:
+    """Рендерить PNG з графіками; виконується в пулі процесів (чисте CPU)."""
+    # Figure + Agg-канва без pyplot: жодного глобального стану і GUI-бекенда
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.dates import DateFormatter
+    from matplotlib.figure import Figure
+    import numpy as np
+    scores = daily_scores(rows, start, days)
+    dates = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + days)
+    fig = Figure(figsize=(8, 6.5 if meds else 3.5), dpi=100)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2 if meds else 1, 1, squeeze=False)[:, 0]
+    ax = axes[0]
+    for metric, series in scores.items():
+        ax.plot(dates, series, label=SCORED_METRICS[metric][0], linewidth=1.8)
+    ax.set_title(f"Тренди (ковзне середнє за {ROLLING_WINDOW} днів)")
+    ax.set_ylim(0.8, 3.2), ax.set_yticks([1, 2, 3], ["низько", "середньо", "високо"])
+    if scores: ax.legend(loc="upper left", fontsize=8)
+    else: ax.text(0.5, 0.5, "Недостатньо даних check-in", ha="center", va="center", transform=ax.transAxes)
+    ax.grid(alpha=0.3)
+    ax.xaxis.set_major_formatter(DateFormatter("%m.%y"))
+    if meds:
+        names = [name for name, _, _ in meds]
+        taken, total = np.array([m[1] or 0 for m in meds], dtype=float), np.array([m[2] for m in meds], dtype=float)
+        adherence = 100 * taken / np.maximum(total, 1)
+        bars = axes[1].barh(names, adherence, color=np.where(adherence >= 80, "#4caf50", "#ff9800"))
+        axes[1].bar_label(bars, [f"{a:.0f}% ({int(t)}/{int(n)})" for a, t, n in zip(adherence, taken, total)], fontsize=8, padding=3)
+        axes[1].set_xlim(0, 115), axes[1].set_title("Прийом ліків")
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
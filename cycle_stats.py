@@ -0,0 +1,129 @@
+# cycle_stats.py — статистика циклів, що оновлюється інкрементально, і щоденні сповіщення про наближення циклу
+
+import datetime
+import logging
+import math
+import sqlite3
+
+from database import Database
+from sender import MessageSender
+
+# Скільки останніх тривалостей враховується в ковзному середньому й дисперсії
+CYCLE_WINDOW = 6
+# Тривалості поза межами — випадкові натискання або пропущені відмітки, в статистику не йдуть
+MIN_CYCLE_LENGTH, MAX_CYCLE_LENGTH = 15, 60
+MAX_PERIOD_DAYS = 14
+# Сповіщати за стільки днів до прогнозованого початку і лише при достатній довірі до прогнозу
+NOTIFY_DAYS_AHEAD = 2
+MIN_NOTIFY_CONFIDENCE = 0.3
+
+UPSERT_SQL = """INSERT INTO cycle_stats (user_id, last_start, lengths, periods, mean_length, variance, mean_period, next_start, confidence)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET last_start = excluded.last_start, lengths = excluded.lengths, periods = excluded.periods,
+                mean_length = excluded.mean_length, variance = excluded.variance, mean_period = excluded.mean_period,
+                next_start = excluded.next_start, confidence = excluded.confidence"""
+
+
+def create_schema(conn: sqlite3.Connection):
+    # lengths/periods — останні CYCLE_WINDOW значень через кому; notified_for — next_start, про який уже сповіщено
+    conn.execute("""CREATE TABLE IF NOT EXISTS cycle_stats (user_id INTEGER PRIMARY KEY, last_start DATE, lengths TEXT DEFAULT '', periods TEXT DEFAULT '',
+                    mean_length REAL, variance REAL, mean_period REAL, next_start DATE, confidence REAL DEFAULT 0, notified_for DATE)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cycle_stats_next_start ON cycle_stats (next_start)")
+
+
+def _parse(text) -> list:
+    return [int(value) for value in text.split(",")] if text else []
+
+
+def confidence(lengths: list, variance: float) -> float:
+    """0..1: більше циклів і менший розкид — вища довіра; розкид від тижня — нуль."""
+    return round(min(len(lengths), CYCLE_WINDOW) / CYCLE_WINDOW * max(0.0, 1 - math.sqrt(variance) / 7), 2)
+
+
+def _row(user_id: int, last_start: datetime.date, lengths: list, periods: list) -> tuple:
+    lengths, periods = lengths[-CYCLE_WINDOW:], periods[-CYCLE_WINDOW:]
+    mean = variance = next_start = None
+    if lengths:
+        mean = sum(lengths) / len(lengths)
+        variance = sum((length - mean) ** 2 for length in lengths) / (len(lengths) - 1) if len(lengths) > 1 else 0.0
+        next_start = last_start + datetime.timedelta(days=round(mean))
+    mean_period = sum(periods) / len(periods) if periods else None
+    return (user_id, last_start, ",".join(map(str, lengths)), ",".join(map(str, periods)), mean, variance, mean_period, next_start,
+            confidence(lengths, variance) if lengths else 0.0)
+
+
+def _add_start(state: list, day: datetime.date) -> bool:
+    last_start, lengths, _ = state
+    if last_start:
+        length = (day - last_start).days
+        if length <= 0: return False  # повторна відмітка того ж дня
+        if MIN_CYCLE_LENGTH <= length <= MAX_CYCLE_LENGTH: lengths.append(length)
+    state[0] = day
+    return True
+
+
+def _add_end(state: list, start: datetime.date, day: datetime.date) -> bool:
+    duration = (day - start).days + 1
+    if not 1 <= duration <= MAX_PERIOD_DAYS: return False
+    state[2].append(duration)
+    return True
+
+
+def _load_state(conn: sqlite3.Connection, user_id: int) -> list:
+    row = conn.execute("SELECT last_start, lengths, periods FROM cycle_stats WHERE user_id = ?", (user_id,)).fetchone()
+    if not row: return [None, [], []]
+    return [datetime.date.fromisoformat(row[0]) if row[0] else None, _parse(row[1]), _parse(row[2])]
+
+
+def on_cycle_start(conn: sqlite3.Connection, user_id: int, day: datetime.date):
+    """Викликається в транзакції, що додає цикл: O(1) замість перечитування історії при кожному відкритті меню."""
+    state = _load_state(conn, user_id)
+    if _add_start(state, day): conn.execute(UPSERT_SQL, _row(user_id, *state))
+
+
+def on_cycle_end(conn: sqlite3.Connection, user_id: int, start: datetime.date, day: datetime.date):
+    state = _load_state(conn, user_id)
+    if _add_end(state, start, day): conn.execute(UPSERT_SQL, _row(user_id, *state))
+
+
+def backfill(conn: sqlite3.Connection):
+    """Перебудовує cycle_stats з таблиці cycles (для баз, що існували до її появи)."""
+    conn.execute("DELETE FROM cycle_stats")
+    states = {}
+    for user_id, start, end in conn.execute("SELECT user_id, start_date, end_date FROM cycles WHERE start_date IS NOT NULL ORDER BY user_id, start_date, cycle_id"):
+        state = states.setdefault(user_id, [None, [], []])
+        start = datetime.date.fromisoformat(start)
+        _add_start(state, start)
+        # Цикл, закритий наступним стартом, має end_date за день до нього — такі «тривалості» відкидає MAX_PERIOD_DAYS
+        if end: _add_end(state, start, datetime.date.fromisoformat(end))
+    conn.executemany(UPSERT_SQL, [_row(user_id, *state) for user_id, state in states.items()])
+
+
+def format_forecast(next_start: datetime.date, today: datetime.date) -> str:
+    days = (next_start - today).days
+    when = "сьогодні" if days <= 0 else "завтра" if days == 1 else f"через {days} дн."
+    return (f"🌸 За прогнозом новий цикл може початися <b>{next_start.strftime('%d.%m')}</b> ({when}).\n"
+            "Коли він почнеться, відмітьте це в меню «🌸 Жіноче здоров'я» — прогноз стане точнішим.")
+
+
+class CycleForecastJob:
+    """Щоденна розсилка прогнозів: один запит за індексом next_start повертає лише тих, кому час сповістити.
+
+    notified_for запам'ятовує прогноз, про який уже сповіщено, тож повторний запуск того ж дня нікого не дублює.
+    """
+
+    def __init__(self, db: Database, sender: MessageSender, days_ahead: int = NOTIFY_DAYS_AHEAD, min_confidence: float = MIN_NOTIFY_CONFIDENCE):
+        self.db = db
+        self.sender = sender
+        self.days_ahead = days_ahead
+        self.min_confidence = min_confidence
+
+    async def run(self, today: datetime.date = None):
+        today = today or datetime.date.today()
+        due = await self.db.fetchall("""SELECT user_id, next_start FROM cycle_stats WHERE next_start BETWEEN ? AND ? AND confidence >= ?
+                                        AND (notified_for IS NULL OR notified_for != next_start)""",
+                                     (today.isoformat(), (today + datetime.timedelta(days=self.days_ahead)).isoformat(), self.min_confidence))
+        for user_id, next_start in due: await self.sender.send(user_id, format_forecast(datetime.date.fromisoformat(next_start), today))
+        await self.sender.drain()
+        if due: await self.db.executemany("UPDATE cycle_stats SET notified_for = ? WHERE user_id = ?", [(next_start, user_id) for user_id, next_start in due])
+        logging.info(f"Прогнози циклу розіслано: {len(due)}")
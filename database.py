@@ -0,0 +1,184 @@
+# database.py — асинхронний шар доступу до SQLite
+
+import asyncio
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Розмір кешу підготовлених запитів на кожне з'єднання (sqlite3 перевикористовує їх за текстом SQL)
+STATEMENT_CACHE_SIZE = 256
+
+
+class Database:
+    """Пул довготривалих з'єднань SQLite у режимі WAL.
+
+    Читання виконуються в пулі потоків (по одному з'єднанню на потік),
+    усі записи — в окремому потоці-записувачі з власним з'єднанням,
+    тож event loop aiogram ніколи не блокується на диску, а записувачі не конкурують за блокування.
+    """
+
+    def __init__(self, path: str, readers: int = 3, busy_timeout: float = 30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        # on_call(function_name, write, seconds) — хук для метрик, викликається в потоці БД
+        self.on_call = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock: self._connections.append(conn)
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None: conn = self._local.conn = self._connect()
+        return conn
+
+    def _call(self, fn, args, write: bool):
+        conn = self._connection()
+        started = time.perf_counter()
+        try:
+            with conn:  # commit при успіху, rollback при винятку
+                return fn(conn, *args)
+        finally:
+            if self.on_call is not None: self.on_call(fn.__name__, write, time.perf_counter() - started)
+
+    async def run(self, fn, *args, write: bool = False):
+        """Виконує fn(conn, *args) в одній транзакції поза event loop."""
+        executor = self._writer if write else self._readers
+        return await asyncio.get_running_loop().run_in_executor(executor, self._call, fn, args, write)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(_fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(_fetchall, sql, params)
+
+    async def execute(self, sql: str, params=()) -> int:
+        return await self.run(_execute, sql, params, write=True)
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        return await self.run(_executemany, sql, seq_of_params, write=True)
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections: conn.close()
+            self._connections.clear()
+        logging.info("З'єднання з базою даних закрито.")
+
+
+def _fetchone(conn: sqlite3.Connection, sql: str, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(conn: sqlite3.Connection, sql: str, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _execute(conn: sqlite3.Connection, sql: str, params) -> int:
+    return conn.execute(sql, params).rowcount
+
+
+def _executemany(conn: sqlite3.Connection, sql: str, seq_of_params) -> int:
+    return conn.executemany(sql, seq_of_params).rowcount
+
+
+def _write_batch(conn: sqlite3.Connection, batch):
+    # Сусідні вставки з однаковим SQL групуються в один executemany, порядок зберігається
+    for sql, rows in itertools.groupby(batch, key=lambda item: item[0]):
+        conn.executemany(sql, [params for _, params in rows])
+
+
+def _write_rows(conn: sqlite3.Connection, batch) -> list:
+    """Порядковий запис пакета, що не пройшов цілком; повертає (sql, params, помилка) рядків, які не записались."""
+    failed = []
+    for sql, params in batch:
+        # Помилка одного оператора SQLite відкочує лише його, транзакція з рештою рядків лишається
+        try: conn.execute(sql, params)
+        except sqlite3.Error as e: failed.append((sql, params, e))
+    return failed
+
+
+class WriteBehindQueue:
+    """Відкладений запис: вставки накопичуються і скидаються однією транзакцією.
+
+    Буфер скидається кожні flush_interval секунд або одразу після max_batch рядків.
+    Якщо в буфері max_pending рядків, put() чекає на скидання (back-pressure).
+    Тимчасова помилка (напр. database is locked) повторюється з паузою, а пакет, що не проходить цілком,
+    записується порядково — відкидаються лише рядки з помилкою, а не дані інших користувачів.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 0.05, max_batch: int = 500, max_pending: int = 10000,
+                 retries: int = 3, retry_backoff: float = 0.5):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._pending = []
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def put(self, sql: str, params):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+        while len(self._pending) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+        self._pending.append((sql, params))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch: self._full.set()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._has_items.clear(), self._full.clear()
+            if not batch: return
+            try:
+                for attempt in range(self.retries + 1):
+                    try: return await self.db.run(_write_batch, batch, write=True)
+                    except sqlite3.OperationalError as e:
+                        if attempt == self.retries: break
+                        logging.warning(f"Пакет із {len(batch)} рядків не записано ({e}), повтор {attempt + 1}/{self.retries}")
+                        try: await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                        except asyncio.CancelledError:
+                            self._pending[:0] = batch  # зупинка під час паузи: пакет допише stop()
+                            raise
+                    except Exception: break
+                for sql, params, error in await self.db.run(_write_rows, batch, write=True):
+                    logging.error(f"Рядок відкинуто з пакета ({error}): {sql} {params!r}")
+            except Exception: logging.exception(f"Не вдалося записати пакет із {len(batch)} рядків:")
+            finally: self._space.set()
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch:
+                try: await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError: pass
+            await self.flush()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
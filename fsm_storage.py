@@ -0,0 +1,128 @@
+# fsm_storage.py — персистентне сховище станів FSM на SQLite
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from database import Database
+
+# Незавершені сценарії (check-in, додавання ліків, опитувальник) забуваються через добу
+FSM_STATE_TTL = 24 * 3600
+FSM_FLUSH_INTERVAL = 1.0
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS fsm_states (storage_key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)")
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: Dict[str, Any] = None, updated_at: float = 0.0):
+        self.state, self.data, self.updated_at = state, data or {}, updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """Сховище FSM з кешем у пам'яті та пакетним записом у БД.
+
+    Читання обслуговуються з кешу (промах — один SELECT), зміни позначають ключ «брудним»,
+    а фоновий цикл раз на flush_interval записує всі брудні ключі одним executemany.
+    Тож п'ять кроків check-in одного користувача між скиданнями дають один запис, а не п'ять.
+    Кеш узгоджений, поки кожен користувач обслуговується одним процесом.
+    """
+
+    def __init__(self, db: Database, ttl: int = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL, key_builder: KeyBuilder = None):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._cache = {}
+        self._dirty = set()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _record(self, key: StorageKey) -> _Record:
+        storage_key = self.key_builder.build(key)
+        record = self._cache.get(storage_key)
+        if record is not None and record.updated_at > time.time() - self.ttl: return record
+        row = await self.db.fetchone("SELECT state, data, updated_at FROM fsm_states WHERE storage_key = ? AND updated_at > ?", (storage_key, int(time.time()) - self.ttl))
+        # Поки чекали на БД, інший обробник міг уже заповнити кеш
+        if (cached := self._cache.get(storage_key)) is not None and cached is not record: return cached
+        record = _Record(row[0], json.loads(row[1]) if row[1] else {}, row[2]) if row else _Record(updated_at=time.time())
+        self._cache[storage_key] = record
+        return record
+
+    def _touch(self, key: StorageKey, record: _Record):
+        record.updated_at = time.time()
+        self._dirty.add(self.key_builder.build(key))
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._record(key)).data)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty: return
+            keys, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for storage_key in keys:
+                record = self._cache.get(storage_key)
+                if record is None or (record.state is None and not record.data):
+                    deletes.append((storage_key,))
+                    self._cache.pop(storage_key, None)  # порожні записи не тримаємо в пам'яті
+                else:
+                    upserts.append((storage_key, record.state, json.dumps(record.data, ensure_ascii=False), int(record.updated_at)))
+            try: await self.db.run(self._write, upserts, deletes, write=True)
+            except Exception:
+                logging.exception("Не вдалося зберегти стани FSM:")
+                self._dirty |= keys  # спробуємо наступного разу
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, upserts, deletes):
+        conn.executemany("INSERT OR REPLACE INTO fsm_states (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?)", upserts)
+        conn.executemany("DELETE FROM fsm_states WHERE storage_key = ?", deletes)
+
+    async def expire(self):
+        """Прибирає покинуті стани з пам'яті та з БД."""
+        deadline = time.time() - self.ttl
+        for storage_key in [k for k, r in self._cache.items() if r.updated_at <= deadline and k not in self._dirty]:
+            del self._cache[storage_key]
+        await self.db.execute("DELETE FROM fsm_states WHERE updated_at <= ?", (int(deadline),))
+
+    async def _run(self):
+        last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - last_expire > 3600:
+                last_expire = time.monotonic()
+                try: await self.expire()
+                except Exception: logging.exception("Помилка очищення станів FSM:")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,114 @@
+# interaction_archive.py — стиснутий помісячний архів старих openai_interactions і прозоре читання з нього
+
+import datetime
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import zlib
+
+from database import Database
+
+# Взаємодії, старші за стільки днів, переносяться в архів цілими місяцями
+ARCHIVE_AFTER_DAYS = int(os.environ.get("AI_ARCHIVE_AFTER_DAYS", "90"))
+# Рядків на одну транзакцію перенесення: записувач не блокується надовго
+ARCHIVE_BATCH = 2000
+# Сторінок, що повертаються ОС за один крок incremental_vacuum
+VACUUM_STEP_PAGES = 2000
+COMPRESSION_LEVEL = 9
+
+
+def create_schema(conn: sqlite3.Connection):
+    # Один стиснутий JSON-масив [[id, timestamp, prompt, response], ...] на користувача і місяць
+    conn.execute("""CREATE TABLE IF NOT EXISTS openai_interactions_archive (user_id INTEGER, month TEXT, count INTEGER, raw_bytes INTEGER, data BLOB,
+                    PRIMARY KEY (user_id, month))""")
+
+
+def archive_cutoff(today: datetime.date, days: int = ARCHIVE_AFTER_DAYS) -> str:
+    """Початок місяця, до якого все вже старше за `days` днів: місяці архівуються цілком, а не частинами."""
+    return (today - datetime.timedelta(days=days)).replace(day=1).isoformat()
+
+
+def _pack(rows) -> tuple:
+    raw = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+    return zlib.compress(raw, COMPRESSION_LEVEL), len(raw)
+
+
+def _unpack(data: bytes) -> list:
+    return json.loads(zlib.decompress(data))
+
+
+def _archive_batch(conn: sqlite3.Connection, cutoff: str, limit: int = ARCHIVE_BATCH) -> tuple:
+    """Переносить до `limit` найстаріших рядків, старших за cutoff. Повертає (рядків, байт до стиснення, байт після)."""
+    # id зростає разом із часом запису: найстаріші рядки — початок таблиці за rowid, індекс за timestamp не потрібен
+    rows = conn.execute("SELECT id, user_id, timestamp, prompt, response FROM openai_interactions ORDER BY id LIMIT ?", (limit,)).fetchall()
+    rows = list(itertools.takewhile(lambda row: (row[2] or "") < cutoff, rows))
+    if not rows: return 0, 0, 0
+    groups = {}
+    for row_id, user_id, timestamp, prompt, response in rows:
+        groups.setdefault((user_id, (timestamp or "")[:7]), []).append([row_id, timestamp, prompt, response])
+    raw_total = packed_total = 0
+    for (user_id, month), items in groups.items():
+        existing = conn.execute("SELECT data FROM openai_interactions_archive WHERE user_id = ? AND month = ?", (user_id, month)).fetchone()
+        if existing:  # місяць, перенесений у кілька пакетів: дописуємо, без дублікатів за id
+            known = {item[0] for item in items}
+            items = [item for item in _unpack(existing[0]) if item[0] not in known] + items
+            items.sort(key=lambda item: item[0])
+        data, raw_bytes = _pack(items)
+        conn.execute("INSERT OR REPLACE INTO openai_interactions_archive (user_id, month, count, raw_bytes, data) VALUES (?, ?, ?, ?, ?)",
+                     (user_id, month, len(items), raw_bytes, data))
+        raw_total, packed_total = raw_total + raw_bytes, packed_total + len(data)
+    conn.executemany("DELETE FROM openai_interactions WHERE id = ?", [(row[0],) for row in rows])
+    return len(rows), raw_total, packed_total
+
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    # Режим auto_vacuum існуючої бази змінюється лише через повний VACUUM — один раз, далі лише incremental_vacuum
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2: return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, pages: int = VACUUM_STEP_PAGES) -> int:
+    """Повертає ОС до `pages` вільних сторінок; результат — скільки вільних сторінок лишилось."""
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()  # прагма виконується покроково — кроки треба вибрати
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def _lookup(conn: sqlite3.Connection, user_id: int, since: str, until: str) -> list:
+    rows = {row[0]: row for row in conn.execute("SELECT id, timestamp, prompt, response FROM openai_interactions WHERE user_id = ? AND timestamp >= ? AND timestamp < ?",
+                                                (user_id, since, until))}
+    for (data,) in conn.execute("SELECT data FROM openai_interactions_archive WHERE user_id = ? AND month >= ? AND month <= ?", (user_id, since[:7], until[:7])):
+        for row_id, timestamp, prompt, response in _unpack(data):
+            if since <= (timestamp or "") < until: rows.setdefault(row_id, (row_id, timestamp, prompt, response))
+    return sorted(rows.values(), key=lambda row: (row[1], row[0]))
+
+
+class InteractionArchive:
+    """Щоденне перенесення старих взаємодій з AI у стиснутий архів (zlib) і прозорий пошук по обох таблицях.
+
+    Живою лишається лише таблиця за останні місяці, тож гарячі таблиці (health_entries тощо) не витісняються
+    з кешу сторінок. Звільнені сторінки повертаються ОС через incremental_vacuum невеликими кроками.
+    """
+
+    def __init__(self, db: Database, after_days: int = ARCHIVE_AFTER_DAYS):
+        self.db = db
+        self.after_days = after_days
+
+    async def run(self, today: datetime.date = None):
+        cutoff = archive_cutoff(today or datetime.date.today(), self.after_days)
+        if await self.db.run(_enable_incremental_vacuum, write=True): logging.info("Базу переведено в режим auto_vacuum=INCREMENTAL")
+        moved = raw = packed = 0
+        while True:
+            count, raw_bytes, packed_bytes = await self.db.run(_archive_batch, cutoff, write=True)
+            if not count: break
+            moved, raw, packed = moved + count, raw + raw_bytes, packed + packed_bytes
+        free = None
+        while (remaining := await self.db.run(_incremental_vacuum, write=True)) and remaining != free: free = remaining
+        if moved: logging.info(f"В архів перенесено {moved} взаємодій з AI до {cutoff}: {raw / 1024:.0f} КБ → {packed / 1024:.0f} КБ")
+
+    async def lookup(self, user_id: int, since: str = "", until: str = "9999-12-31") -> list:
+        """(id, timestamp, prompt, response) користувача за [since, until) — з живої таблиці й архіву, за часом."""
+        return await self.db.run(_lookup, user_id, since, until)
@@ -1,14 +1,22 @@
+import startup  # першим: від цього моменту відраховується час запуску
 import logging
 import asyncio
 import os
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from openai import AsyncOpenAI
+with startup.phase("імпорт aiogram"):
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
 
 # Імпортуємо роутер та функцію on_startup з нашого основного файлу
-from med_bot_aiogram import router, on_startup 
+with startup.phase("імпорт med_bot_aiogram"):
+    from med_bot_aiogram import router, on_startup, on_shutdown, AI_MODEL, db
+with startup.phase("імпорт інших модулів"):
+    from ai_client import ResilientAIClient
+    from fsm_storage import SQLiteStorage
+    from webhook_server import run_webhook, run_webhook_proxy, wait_for_stop_signal
+    from sharding import Supervisor, consume
+    import metrics
 
 # Налаштування логування
 logging.basicConfig(level=logging.INFO,
@@ -16,6 +24,30 @@ logging.basicConfig(level=logging.INFO,
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+# Захист від повільного/недоступного OpenRouter
+AI_FALLBACK_MODEL = os.environ.get("AI_FALLBACK_MODEL")
+AI_TIMEOUT = float(os.environ.get("AI_TIMEOUT", "60"))
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "20"))
+# Сховище станів FSM: sqlite (типово), redis (потрібні пакет redis і REDIS_URL) або memory
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "sqlite")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Режим отримання оновлень: polling (типово) або webhook (потрібна публічна HTTPS-адреса WEBHOOK_BASE_URL)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None
+WEBAPP_HOST = os.environ.get("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.environ.get("WEBAPP_PORT", os.environ.get("PORT", "8080")))
+# Накопичені за час деплою оновлення типово обробляються, а не відкидаються
+DROP_PENDING_UPDATES = os.environ.get("DROP_PENDING_UPDATES", "0") == "1"
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "30"))
+# Кількість процесів-воркерів; більше 1 — супервізор отримує оновлення і розподіляє їх за user_id
+WORKERS = int(os.environ.get("WORKERS", "1"))
+# Порт окремого HTTP-сервера з /metrics (0 — вимкнено); на публічному порту webhook метрик немає.
+# З кількома воркерами кожен віддає свої метрики на METRICS_PORT + номер воркера
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Типово лише локально: метрики розкривають трафік і внутрішні черги, назовні — явно через METRICS_HOST
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
 
 # --- ПЕРЕВІРТЕ НАЯВНІСТЬ ЦИХ РЯДКІВ ---
 if BOT_TOKEN:
@@ -25,35 +57,118 @@ else:
 # --- КІНЕЦЬ ДІАГНОСТИЧНИХ РЯДКІВ ---
 
 
+def create_fsm_storage():
+    if FSM_STORAGE == "memory": return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        # Будь-який сервер з протоколом Redis (Redis, KeyDB, локальна заглушка для тестів)
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(REDIS_URL, state_ttl=86400, data_ttl=86400)
+    return SQLiteStorage(db)
+
+
 # !!! ТИМЧАСОВО ДОДАЙТЕ ЦЕЙ РЯДОК ДЛЯ ПЕРЕВІРКИ (опціонально) !!!
 # Якщо хочете перевірити, що скрипт бачить ключ OpenRouter
 print(f"Using API key (OpenRouter): {OPENROUTER_API_KEY[:5]}...{OPENROUTER_API_KEY[-5:]}")
 # !!! НЕ ЗАБУДЬТЕ ВИДАЛИТИ ЦЕЙ РЯДОК ПІСЛЯ ПЕРЕВІРКИ !!!
 
 
-async def main():
-    # Ініціалізація клієнта OpenAI
-    # !!! ВИПРАВЛЕНО: Використовуємо AsyncOpenAI замість OpenAI !!!
-    openai_client = AsyncOpenAI( # <--- Ось тут зміна!
+def create_openai_client():
+    # Ініціалізація клієнта OpenAI відкладена до першого запиту до AI (openai імпортується ~1 с)
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
         api_key=OPENROUTER_API_KEY,
-        base_url="https://openrouter.ai/api/v1/"
+        base_url="https://openrouter.ai/api/v1/",
+        max_retries=0  # повтори, таймаути і ліміти робить ResilientAIClient
     )
 
+
+def create_bot_and_dispatcher():
+    ai_client = ResilientAIClient(create_openai_client, model=AI_MODEL, fallback_model=AI_FALLBACK_MODEL, timeout=AI_TIMEOUT, max_concurrency=AI_MAX_CONCURRENCY)
+
     # Ініціалізація бота та диспетчера
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    storage = MemoryStorage()
+    storage = create_fsm_storage()
     dp = Dispatcher(storage=storage)
 
     # Підключаємо роутер з обробниками з іншого файлу
     dp.include_router(router)
     # Реєструємо функцію, яка виконається при старті
     dp.startup.register(on_startup)
+    # Закриваємо пул з'єднань з БД при зупинці
+    dp.shutdown.register(on_shutdown)
+    # Звіт про час запуску — після всіх обробників startup
+    dp.startup.register(startup.report)
+    dp.update.outer_middleware(startup.first_update_middleware)
+    # ai_client доступний усім хендлерам незалежно від режиму запуску
+    dp["ai_client"] = ai_client
+    metrics.ai_in_flight.set_function(lambda: ai_client.in_flight)
+    return bot, dp
+
+
+# --- Режим з кількома воркерами ---
+def run_worker(index: int, shards: int, updates):
+    asyncio.run(_worker(index, updates))
+
+async def _worker(index: int, updates):
+    bot, dp = create_bot_and_dispatcher()
+    metrics_runner = await metrics.start_http_server(METRICS_HOST, METRICS_PORT + index) if METRICS_PORT else None
+    logging.info(f"Воркер {index} готовий до обробки оновлень")
+    try: await consume(dp, bot, updates, drain_timeout=SHUTDOWN_TIMEOUT)
+    finally:
+        if metrics_runner: await metrics_runner.cleanup()
+
+async def poll_updates(bot: Bot, supervisor: Supervisor, allowed_updates):
+    offset = None
+    while True:
+        try: updates = await bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed_updates)
+        except Exception:
+            logging.exception("Помилка отримання оновлень:")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await supervisor.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+async def supervise(bot: Bot, dp: Dispatcher):
+    supervisor = Supervisor(run_worker, WORKERS)
+    supervisor.start()
+    watcher = asyncio.create_task(supervisor.watch())
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook_proxy(bot, supervisor.dispatch, WEBHOOK_BASE_URL, WEBHOOK_PATH, allowed_updates, secret_token=WEBHOOK_SECRET,
+                                    host=WEBAPP_HOST, port=WEBAPP_PORT, drop_pending_updates=DROP_PENDING_UPDATES)
+        else:
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            poller = asyncio.create_task(poll_updates(bot, supervisor, allowed_updates))
+            # Непідтверджені (ще не отримані) оновлення залишаться в Telegram до наступного запуску
+            try: await wait_for_stop_signal()
+            finally: poller.cancel()
+    finally:
+        watcher.cancel()
+        await supervisor.stop(SHUTDOWN_TIMEOUT)
+
+
+async def main():
+    bot, dp = create_bot_and_dispatcher()
 
     try:
-        print(f"Starting bot @{(await bot.get_me()).username}...")
-        await bot.delete_webhook(drop_pending_updates=True)
-        # Передаємо openai_client в усі хендлери через start_polling
-        await dp.start_polling(bot, openai_client=openai_client)
+        with startup.phase("get_me"): me = await bot.get_me()
+        print(f"Starting bot @{me.username} ({BOT_MODE}, workers: {WORKERS})...")
+        if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL: raise RuntimeError("Для режиму webhook потрібна змінна WEBHOOK_BASE_URL")
+        if WORKERS > 1:
+            await supervise(bot, dp)
+        else:
+            metrics_runner = await metrics.start_http_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+            try:
+                if BOT_MODE == "webhook":
+                    await run_webhook(dp, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, host=WEBAPP_HOST, port=WEBAPP_PORT,
+                                      drop_pending_updates=DROP_PENDING_UPDATES, drain_timeout=SHUTDOWN_TIMEOUT)
+                else:
+                    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+                    await dp.start_polling(bot)
+            finally:
+                if metrics_runner: await metrics_runner.cleanup()
 
     except Exception as e:
         logging.exception("Bot polling stopped due to an error:")
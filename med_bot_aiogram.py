@@ -4,29 +4,64 @@ import asyncio
 import logging
 import sqlite3
 import datetime
+import html
 import re
 import time
+import functools
+import importlib
 import os
-import matplotlib.pyplot as plt
-from fpdf import FPDF
 
-from openai import AsyncOpenAI
 
 from aiogram import Bot, F, types, Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 
-import schedule
+from database import Database, WriteBehindQueue
+from cache import TTLCache, MISSING
+from scheduler import ReminderScheduler, parse_hhmm
+from sender import MessageSender
+import reminders
+from reminders import ReminderSlots
+import reports
+import charts
+import ai_cache
+from ai_cache import AIResponseCache
+import prompts
+from achievements import AchievementEngine
+from streaming import stream_to_message
+from ai_client import ResilientAIClient, AIUnavailableError, AIBusyError
+import fsm_storage
+import sharding
+import rollups
+import cycle_stats
+from cycle_stats import CycleForecastJob
+import weekly_reports
+from weekly_reports import WeeklyReportJob
+import interaction_archive
+from interaction_archive import InteractionArchive
+from migrations import apply_migrations, add_column
+import metrics
+from metrics import db_timed
+import startup
 
 # --- КОНФІГУРАЦІЯ ---
 DATABASE_NAME = 'health_log.db'
 PRIVACY_POLICY_URL = "https://telegra.ph/Pol%D1%96tika-konf%D1%96denc%D1%96jnost%D1%96-dlya-medichnogo-pom%D1%96chnika-med-pomichnyk-bot-07-22-2" # Приклад, замініть на своє посилання
 ANALYZE_BTN_TEXT = "🤔 Проаналізувати симптоми (AI)"
+AI_MODEL = "openai/gpt-4o-mini"
+# Показувати відповідь AI по мірі генерації (редагуванням одного повідомлення)
+AI_STREAMING = True
+# Після старту у фоні прогрівати пул звітів (fpdf, matplotlib) та імпортувати openai
+PREWARM = os.environ.get("PREWARM", "1") == "1"
 
 # Ініціалізація роутера
 router = Router()
+# Латентність і помилки кожного обробника (metrics.MetricsMiddleware)
+router.message.middleware(metrics.MetricsMiddleware())
+router.callback_query.middleware(metrics.MetricsMiddleware())
 
 # --- СТАНИ FSM ---
 class Form(StatesGroup):
@@ -55,179 +90,224 @@ class Form(StatesGroup):
     waiting_for_note = State()
 
 # --- БАЗА ДАНИХ ---
-def setup_database():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, age INTEGER, gender TEXT, weight_kg REAL, height_cm REAL)")
-    cursor.execute("CREATE TABLE IF NOT EXISTS health_entries (entry_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, mood TEXT, sleep_quality TEXT, systolic_pressure INTEGER, diastolic_pressure INTEGER, FOREIGN KEY (user_id) REFERENCES users(user_id))")
-    cursor.execute("CREATE TABLE IF NOT EXISTS medications (med_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, med_name TEXT NOT NULL, dosage TEXT, schedule TEXT, is_active BOOLEAN DEFAULT 1, FOREIGN KEY (user_id) REFERENCES users(user_id))")
-    cursor.execute("CREATE TABLE IF NOT EXISTS medication_log (log_id INTEGER PRIMARY KEY AUTOINCREMENT, med_id INTEGER, user_id INTEGER, timestamp DATETIME, status TEXT, FOREIGN KEY (med_id) REFERENCES medications(med_id))")
-    cursor.execute("CREATE TABLE IF NOT EXISTS openai_interactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, prompt TEXT, response TEXT)")
-    cursor.execute("CREATE TABLE IF NOT EXISTS cycles (cycle_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, start_date DATE, end_date DATE, FOREIGN KEY (user_id) REFERENCES users(user_id))")
-
-    try: cursor.execute("ALTER TABLE users ADD COLUMN checkin_streak INTEGER DEFAULT 0")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN last_checkin_date DATE")
-    except: pass
-    try: cursor.execute("ALTER TABLE health_entries ADD COLUMN note TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN blood_group TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN allergies TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN chronic_diseases TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN emergency_contact TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE health_entries ADD COLUMN activity_level TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE health_entries ADD COLUMN stress_level TEXT")
-    except: pass
-    try: cursor.execute("ALTER TABLE health_entries ADD COLUMN water_intake TEXT")
-    except: pass
-
-    cursor.execute("CREATE TABLE IF NOT EXISTS achievements (code TEXT PRIMARY KEY, name TEXT, description TEXT, icon TEXT)")
-    cursor.execute("CREATE TABLE IF NOT EXISTS user_achievements (user_id INTEGER, achievement_code TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, achievement_code), FOREIGN KEY (user_id) REFERENCES users(user_id), FOREIGN KEY (achievement_code) REFERENCES achievements(code))")
+db = Database(DATABASE_NAME)
+db.on_call = metrics.observe_db_call
+# Вставки в журнальні таблиці пишуться пакетами, а не по одному commit на натискання кнопки
+write_queue = WriteBehindQueue(db)
+metrics.write_queue_depth.set_function(lambda: len(write_queue))
+# Профілі читаються майже в кожному обробнику; інвалідуються при будь-якій зміні користувача
+profile_cache = TTLCache(maxsize=5000, ttl=600)
+# Відповіді AI на однакові скарги (з урахуванням вікової групи, статі, алергій і хвороб) беруться з кешу
+ai_response_cache = AIResponseCache(db)
+# Каталог досягнень і отримані коди активних користувачів — у пам'яті, перевірка в обробниках без запитів
+achievement_engine = AchievementEngine(db)
+
+# --- МІГРАЦІЇ СХЕМИ ---
+def _migration_base_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, age INTEGER, gender TEXT, weight_kg REAL, height_cm REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS health_entries (entry_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, mood TEXT, sleep_quality TEXT, systolic_pressure INTEGER, diastolic_pressure INTEGER, FOREIGN KEY (user_id) REFERENCES users(user_id))")
+    conn.execute("CREATE TABLE IF NOT EXISTS medications (med_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, med_name TEXT NOT NULL, dosage TEXT, schedule TEXT, is_active BOOLEAN DEFAULT 1, FOREIGN KEY (user_id) REFERENCES users(user_id))")
+    conn.execute("CREATE TABLE IF NOT EXISTS medication_log (log_id INTEGER PRIMARY KEY AUTOINCREMENT, med_id INTEGER, user_id INTEGER, timestamp DATETIME, status TEXT, FOREIGN KEY (med_id) REFERENCES medications(med_id))")
+    conn.execute("CREATE TABLE IF NOT EXISTS openai_interactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, prompt TEXT, response TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS cycles (cycle_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, start_date DATE, end_date DATE, FOREIGN KEY (user_id) REFERENCES users(user_id))")
+    # Колонки, що з'явились після першого релізу (старі бази можуть їх не мати)
+    for column, declaration in (("checkin_streak", "INTEGER DEFAULT 0"), ("last_checkin_date", "DATE"), ("blood_group", "TEXT"), ("allergies", "TEXT"), ("chronic_diseases", "TEXT"), ("emergency_contact", "TEXT")):
+        add_column(conn, "users", column, declaration)
+    for column in ("note", "activity_level", "stress_level", "water_intake"):
+        add_column(conn, "health_entries", column, "TEXT")
+    conn.execute("CREATE TABLE IF NOT EXISTS achievements (code TEXT PRIMARY KEY, name TEXT, description TEXT, icon TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS user_achievements (user_id INTEGER, achievement_code TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (user_id, achievement_code), FOREIGN KEY (user_id) REFERENCES users(user_id), FOREIGN KEY (achievement_code) REFERENCES achievements(code))")
     achievements_data = [('FIRST_REPORT', 'Перший звіт', 'Ви згенерували свій перший звіт для лікаря.', '📄'), ('STREAK_5_DAYS', 'Стабільність', 'Ви ведете щоденник 5 днів поспіль.', '🔥'), ('FIRST_NOTE', 'Нотатки', 'Ви зробили свій перший швидкий запис.', '✍️')]
-    cursor.executemany("INSERT OR IGNORE INTO achievements (code, name, description, icon) VALUES (?, ?, ?, ?)", achievements_data)
-
-    conn.commit()
-    conn.close()
+    conn.executemany("INSERT OR IGNORE INTO achievements (code, name, description, icon) VALUES (?, ?, ?, ?)", achievements_data)
+
+def _migration_module_tables(conn: sqlite3.Connection):
+    reminders.create_schema(conn)
+    ai_cache.create_schema(conn)
+    fsm_storage.create_schema(conn)
+    sharding.create_schema(conn)
+
+def _migration_hot_query_indexes(conn: sqlite3.Connection):
+    # Вартість запитів має залежати від кількості записів користувача, а не всієї бази.
+    # rowid (entry_id, log_id) неявно входить у кожен індекс, тож (user_id, timestamp) покриває і сортування за ним
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_health_entries_user_ts ON health_entries (user_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_medications_user_active ON medications (user_id, is_active)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_medication_log_user_ts ON medication_log (user_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_medication_log_med_ts ON medication_log (med_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cycles_user_start ON cycles (user_id, start_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_openai_interactions_user_ts ON openai_interactions (user_id, timestamp)")
+    # user_achievements вже має PRIMARY KEY (user_id, achievement_code) — окремий індекс не потрібен
+    conn.execute("ANALYZE")
+
+def _migration_rollups(conn: sqlite3.Connection):
+    rollups.create_schema(conn)
+    rollups.backfill(conn)
+
+def _migration_cycle_stats(conn: sqlite3.Connection):
+    cycle_stats.create_schema(conn)
+    cycle_stats.backfill(conn)
+
+# Нові зміни схеми додаються лише в кінець списку з наступною версією; застосовані кроки не редагуються
+MIGRATIONS = [
+    (1, "базова схема", _migration_base_schema),
+    (2, "таблиці модулів (нагадування, кеш AI, FSM, lease)", _migration_module_tables),
+    (3, "індекси для гарячих запитів", _migration_hot_query_indexes),
+    (4, "денні й тижневі зрізи (health_rollups)", _migration_rollups),
+    (5, "прогрес тижневих звітів", weekly_reports.create_schema),
+    (6, "статистика циклів (cycle_stats)", _migration_cycle_stats),
+    (7, "стиснутий архів взаємодій з AI", interaction_archive.create_schema),
+]
+
+def _setup_schema(conn: sqlite3.Connection):
+    apply_migrations(conn, MIGRATIONS)
+
+async def setup_database():
+    await db.run(_setup_schema, write=True)
     logging.info("Базу даних перевірено та налаштовано.")
 
-def create_or_update_user(user_id: int, first_name: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO users (user_id, first_name) VALUES (?, ?)", (user_id, first_name))
-    cursor.execute("UPDATE users SET first_name = ? WHERE user_id = ?", (first_name, user_id))
-    conn.commit()
-    conn.close()
-
-def get_user_profile(user_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.execute("SELECT first_name, age, gender, weight_kg, height_cm, blood_group, allergies, chronic_diseases, emergency_contact FROM users WHERE user_id = ?", (user_id,))
-    profile = cursor.fetchone()
-    conn.close()
+def _create_or_update_user(conn: sqlite3.Connection, user_id: int, first_name: str):
+    conn.execute("INSERT OR IGNORE INTO users (user_id, first_name) VALUES (?, ?)", (user_id, first_name))
+    conn.execute("UPDATE users SET first_name = ? WHERE user_id = ?", (first_name, user_id))
+
+@db_timed
+async def create_or_update_user(user_id: int, first_name: str):
+    await db.run(_create_or_update_user, user_id, first_name, write=True)
+    profile_cache.invalidate(user_id)
+
+@db_timed
+async def get_user_profile(user_id: int):
+    if (profile := profile_cache.get(user_id)) is not MISSING: return profile
+    generation = profile_cache.generation
+    profile = await db.fetchone("SELECT first_name, age, gender, weight_kg, height_cm, blood_group, allergies, chronic_diseases, emergency_contact FROM users WHERE user_id = ?", (user_id,))
+    profile_cache.set(user_id, profile, generation=generation)
     return profile
 
-def update_user_field(user_id: int, field: str, value):
+@db_timed
+async def update_user_field(user_id: int, field: str, value):
     allowed_fields = ["age", "gender", "weight_kg", "height_cm", "blood_group", "allergies", "chronic_diseases", "emergency_contact"]
     if field not in allowed_fields: return
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
-    conn.commit()
-    conn.close()
-
-def save_health_entry(user_id, **kwargs):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    valid_keys = ['mood', 'sleep_quality', 'note', 'activity_level', 'stress_level', 'water_intake']
-    filtered_kwargs = {k: v for k, v in kwargs.items() if k in valid_keys and v is not None}
+    await db.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
+    profile_cache.invalidate(user_id)
+
+HEALTH_ENTRY_FIELDS = ['mood', 'sleep_quality', 'note', 'activity_level', 'stress_level', 'water_intake']
+
+def _utc_timestamp() -> str:
+    # Той самий формат, що й у DEFAULT CURRENT_TIMESTAMP, але на момент події, а не запису пакета
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+@db_timed
+async def save_health_entry(user_id, **kwargs):
+    filtered_kwargs = {k: v for k, v in kwargs.items() if k in HEALTH_ENTRY_FIELDS and v is not None}
     if not filtered_kwargs: return
-    columns = ', '.join(filtered_kwargs.keys())
-    placeholders = ', '.join('?' * len(filtered_kwargs))
-    sql = f"INSERT INTO health_entries (user_id, {columns}) VALUES (?, {placeholders})"
-    values = (user_id,) + tuple(filtered_kwargs.values())
-    cursor.execute(sql, values)
-    conn.commit()
-    conn.close()
-
-def get_user_history(user_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT timestamp, mood, sleep_quality, note, activity_level, stress_level, water_intake FROM health_entries WHERE user_id = ? ORDER BY timestamp DESC LIMIT 15", (user_id,))
-    history = cursor.fetchall()
-    conn.close()
-    return history
-
-def check_achievement(user_id: int, achievement_code: str) -> bool:
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM user_achievements WHERE user_id = ? AND achievement_code = ?", (user_id, achievement_code))
-    exists = cursor.fetchone()
-    conn.close()
-    return exists is not None
-
-async def award_achievement(user_id: int, achievement_code: str, message: Message):
-    if not check_achievement(user_id, achievement_code):
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO user_achievements (user_id, achievement_code) VALUES (?, ?)", (user_id, achievement_code))
-        cursor.execute("SELECT name, icon FROM achievements WHERE code = ?", (achievement_code,))
-        ach = cursor.fetchone()
-        conn.commit()
-        conn.close()
-        if ach:
-            await message.answer(f"{ach[1]} Досягнення отримано: **{ach[0]}**!")
+    # Повний набір колонок, щоб усі вставки мали однаковий SQL і групувалися в один executemany
+    sql = f"INSERT INTO health_entries (user_id, timestamp, {', '.join(HEALTH_ENTRY_FIELDS)}) VALUES (?, ?, {', '.join('?' * len(HEALTH_ENTRY_FIELDS))})"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    values = (user_id, now.strftime('%Y-%m-%d %H:%M:%S')) + tuple(filtered_kwargs.get(k) for k in HEALTH_ENTRY_FIELDS)
+    await write_queue.put(sql, values)
+    # Зрізи оновлюються в тому ж пакеті, що й сам запис; день зрізу — локальний, як у ліків і тижневих звітів
+    for params in rollups.entry_increments(user_id, now.astimezone().date(), filtered_kwargs): await write_queue.put(rollups.UPSERT_SQL, params)
+
+@db_timed
+async def get_user_history(user_id: int):
+    await write_queue.flush()  # щойно збережені записи мають бути видимі в історії
+    return await db.fetchall("SELECT timestamp, mood, sleep_quality, note, activity_level, stress_level, water_intake FROM health_entries WHERE user_id = ? ORDER BY timestamp DESC LIMIT 15", (user_id,))
+
+HISTORY_PAGE_SIZE = 10
+
+@db_timed
+async def get_history_page(user_id: int, cursor=None, newer: bool = False, date_from: str = None, date_to: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """Сторінка історії за ключем (timestamp, entry_id) — вартість не залежить від глибини гортання.
+
+    cursor — (timestamp, entry_id) краю попередньої сторінки; newer=True гортає до новіших записів
+    (тоді рядки повертаються за зростанням). Повертається до limit + 1 рядків: зайвий означає, що далі ще є.
+    """
+    if cursor is None: await write_queue.flush()  # щойно збережені записи мають бути видимі в історії
+    sql, params = "SELECT entry_id, timestamp, mood, sleep_quality, note, activity_level, stress_level, water_intake FROM health_entries WHERE user_id = ?", [user_id]
+    if date_from: sql, params = sql + " AND timestamp >= ?", params + [date_from]
+    if date_to: sql, params = sql + " AND timestamp < ?", params + [date_to]
+    if cursor: sql, params = sql + f" AND (timestamp, entry_id) {'>' if newer else '<'} (?, ?)", params + list(cursor)
+    order = "ASC" if newer else "DESC"
+    return await db.fetchall(f"{sql} ORDER BY timestamp {order}, entry_id {order} LIMIT ?", params + [limit + 1])
+
+async def award_achievements(user_id: int, event: str, message: Message, value=None):
+    for name, icon in await achievement_engine.emit(user_id, event, value):
+        await message.answer(f"{icon} Досягнення отримано: **{name}**!")
 # ... (інші функції БД) ...
-def add_medication(user_id: int, name: str, dosage: str, schedule: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO medications (user_id, med_name, dosage, schedule) VALUES (?, ?, ?, ?)", (user_id, name, dosage, schedule))
-    conn.commit()
-    conn.close()
-
-def get_user_medications(user_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT med_id, med_name, dosage, schedule FROM medications WHERE user_id = ? AND is_active = 1", (user_id,))
-    meds = cursor.fetchall()
-    conn.close()
-    return meds
-
-def log_medication_status(user_id: int, med_id: int, status: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO medication_log (user_id, med_id, timestamp, status) VALUES (?, ?, ?, ?)", (user_id, med_id, datetime.datetime.now(), status))
-    conn.commit()
-    conn.close()
-
-def set_medication_inactive(med_id: int, user_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE medications SET is_active = 0 WHERE med_id = ? AND user_id = ?", (med_id, user_id))
-    conn.commit()
-    conn.close()
-
-def save_openai_interaction(user_id, prompt, response):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO openai_interactions (user_id, prompt, response) VALUES (?, ?, ?)", (user_id, prompt, response))
-    conn.commit()
-    conn.close()
-
-def start_new_cycle(user_id: int):
-    today = datetime.date.today()
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE cycles SET end_date = ? WHERE user_id = ? AND end_date IS NULL", (today - datetime.timedelta(days=1), user_id))
-    cursor.execute("INSERT INTO cycles (user_id, start_date) VALUES (?, ?)", (user_id, today))
-    conn.commit()
-    conn.close()
-
-def end_current_cycle(user_id: int):
-    today = datetime.date.today()
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE cycles SET end_date = ? WHERE user_id = ? AND end_date IS NULL", (today, user_id))
-    updated_rows = cursor.rowcount
-    conn.commit()
-    conn.close()
-    return updated_rows > 0
-
-def get_cycle_predictions(user_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT start_date, end_date FROM cycles WHERE user_id = ? AND end_date IS NOT NULL ORDER BY start_date DESC LIMIT 5", (user_id,))
-    cycles = cursor.fetchall()
-    conn.close()
-    if len(cycles) < 2: return None, None
-    lengths = [(datetime.datetime.strptime(cycles[i][0], '%Y-%m-%d').date() - datetime.datetime.strptime(cycles[i+1][0], '%Y-%m-%d').date()).days for i in range(len(cycles) - 1)]
-    avg_length = int(sum(lengths) / len(lengths))
-    last_start_date = datetime.datetime.strptime(cycles[0][0], '%Y-%m-%d').date()
-    predicted_date = last_start_date + datetime.timedelta(days=avg_length)
-    return avg_length, predicted_date.strftime("%d-%m-%Y")
+def _add_medication(conn: sqlite3.Connection, user_id: int, name: str, dosage: str, schedule: str) -> int:
+    med_id = conn.execute("INSERT INTO medications (user_id, med_name, dosage, schedule) VALUES (?, ?, ?, ?)", (user_id, name, dosage, schedule)).lastrowid
+    reminders.insert_slots(conn, user_id, med_id, schedule)
+    return med_id
+
+@db_timed
+async def add_medication(user_id: int, name: str, dosage: str, schedule: str) -> int:
+    return await db.run(_add_medication, user_id, name, dosage, schedule, write=True)
+
+@db_timed
+async def get_user_medications(user_id: int):
+    return await db.fetchall("SELECT med_id, med_name, dosage, schedule FROM medications WHERE user_id = ? AND is_active = 1", (user_id,))
+
+@db_timed
+async def log_medication_status(user_id: int, med_id: int, status: str):
+    now = datetime.datetime.now()
+    await write_queue.put("INSERT INTO medication_log (user_id, med_id, timestamp, status) VALUES (?, ?, ?, ?)", (user_id, med_id, now, status))
+    for params in rollups.medication_increments(user_id, now.date(), status): await write_queue.put(rollups.UPSERT_SQL, params)
+
+def _set_medication_inactive(conn: sqlite3.Connection, med_id: int, user_id: int) -> bool:
+    if conn.execute("UPDATE medications SET is_active = 0 WHERE med_id = ? AND user_id = ?", (med_id, user_id)).rowcount == 0: return False
+    reminders.delete_slots(conn, med_id)
+    return True
+
+@db_timed
+async def set_medication_inactive(med_id: int, user_id: int) -> bool:
+    return await db.run(_set_medication_inactive, med_id, user_id, write=True)
+
+@db_timed
+async def save_openai_interaction(user_id, prompt, response):
+    await write_queue.put("INSERT INTO openai_interactions (user_id, timestamp, prompt, response) VALUES (?, ?, ?, ?)", (user_id, _utc_timestamp(), prompt, response))
+
+def _start_new_cycle(conn: sqlite3.Connection, user_id: int, today: datetime.date):
+    conn.execute("UPDATE cycles SET end_date = ? WHERE user_id = ? AND end_date IS NULL", (today - datetime.timedelta(days=1), user_id))
+    conn.execute("INSERT INTO cycles (user_id, start_date) VALUES (?, ?)", (user_id, today))
+    cycle_stats.on_cycle_start(conn, user_id, today)
+
+@db_timed
+async def start_new_cycle(user_id: int):
+    await db.run(_start_new_cycle, user_id, datetime.date.today(), write=True)
+
+def _end_current_cycle(conn: sqlite3.Connection, user_id: int, today: datetime.date) -> bool:
+    row = conn.execute("SELECT MAX(start_date) FROM cycles WHERE user_id = ? AND end_date IS NULL", (user_id,)).fetchone()
+    if not row[0]: return False
+    conn.execute("UPDATE cycles SET end_date = ? WHERE user_id = ? AND end_date IS NULL", (today, user_id))
+    cycle_stats.on_cycle_end(conn, user_id, datetime.date.fromisoformat(row[0]), today)
+    return True
+
+@db_timed
+async def end_current_cycle(user_id: int) -> bool:
+    return await db.run(_end_current_cycle, user_id, datetime.date.today(), write=True)
+
+@db_timed
+async def get_cycle_predictions(user_id: int):
+    """(середня тривалість, стандартне відхилення, дата наступного початку, довіра 0..1) або None — один запит за ключем."""
+    row = await db.fetchone("SELECT mean_length, variance, next_start, confidence FROM cycle_stats WHERE user_id = ? AND next_start IS NOT NULL", (user_id,))
+    if not row: return None
+    mean, variance, next_start, confidence = row
+    return mean, variance ** 0.5, datetime.date.fromisoformat(next_start), confidence
+
+def _update_checkin_streak(conn: sqlite3.Connection, user_id: int, today: datetime.date) -> int:
+    streak_data = conn.execute("SELECT checkin_streak, last_checkin_date FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    current_streak, last_date_str = (streak_data[0] or 0, streak_data[1]) if streak_data else (0, None)
+    new_streak = current_streak
+    if last_date_str:
+        last_date = datetime.datetime.strptime(last_date_str, '%Y-%m-%d').date()
+        delta = today - last_date
+        if delta.days == 1: new_streak += 1
+        elif delta.days > 1: new_streak = 1
+    else: new_streak = 1
+    conn.execute("UPDATE users SET checkin_streak = ?, last_checkin_date = ? WHERE user_id = ?", (new_streak, today.strftime('%Y-%m-%d'), user_id))
+    return new_streak
+
+@db_timed
+async def update_checkin_streak(user_id: int) -> int:
+    return await db.run(_update_checkin_streak, user_id, datetime.date.today(), write=True)
 
 
 # --- Рушій Рекомендацій ---
@@ -249,70 +329,101 @@ def generate_daily_recommendation(data: dict) -> str:
         return "💡 **Ось декілька порад на основі ваших записів:**\n\n- " + "\n- ".join(recommendations)
 
 # --- Аналітика та звіти ---
-def generate_doctor_report_pdf(user_id: int) -> str:
-    profile, history = get_user_profile(user_id), get_user_history(user_id)
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)
-    pdf.set_font('DejaVu', '', 16)
-    pdf.cell(0, 10, 'Звіт про стан здоров\'я', 0, 1, 'C')
-    pdf.set_font('DejaVu', '', 12)
-    pdf.cell(0, 10, f'Пацієнт: {profile[0] if profile else "N/A"}', 0, 1, 'C')
-    pdf.cell(0, 10, f'Дата генерації: {datetime.date.today().strftime("%d-%m-%Y")}', 0, 1, 'C'), pdf.ln(10)
-    pdf.set_font('DejaVu', '', 14), pdf.cell(0, 10, 'Останні записи:', 0, 1), pdf.set_font('DejaVu', '', 10)
-    for record in history:
-        timestamp, mood, sleep, note, activity, stress, water = record
-        dt_object = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        line = f"{dt_object.strftime('%d-%m-%y %H:%M')}: "
-        if note: line += f"Нотатка - {note}. "
-        if mood: line += f"Настрій - {mood}. "
-        if sleep: line += f"Сон - {sleep}. "
-        if activity: line += f"Активність - {activity}. "
-        if stress: line += f"Стрес - {stress}. "
-        if water: line += f"Вода - {water}. "
-        pdf.multi_cell(0, 5, line)
-    filepath = f"report_{user_id}.pdf"
-    pdf.output(filepath)
-    return filepath
+# Не більше одного звіту одночасно на користувача
+_reports_in_progress = set()
+
+# Графіки кешуються за (користувач, версія даних, день): новий запис чи відмітка про ліки змінюють версію
+trends_cache = TTLCache(maxsize=500, ttl=3600)
+
+async def get_trends_chart(user_id: int):
+    """PNG з трендами за останній рік або None, якщо даних ще немає."""
+    await write_queue.flush()
+    today = datetime.date.today()
+    key = (user_id, await db.run(charts.data_version, user_id), today)
+    if (png := trends_cache.get(key)) is not MISSING: return png
+    since = today - datetime.timedelta(days=charts.TRENDS_DAYS - 1)
+    rows, meds = await db.run(charts.load_trend_data, user_id, since)
+    png = await asyncio.get_running_loop().run_in_executor(reports.get_pool(), charts.render_trends_png, rows, meds, since) if rows or meds else None
+    trends_cache.set(key, png)
+    return png
+
+async def generate_doctor_report_pdf(user_id: int) -> bytes:
+    profile, history = await get_user_profile(user_id), await get_user_history(user_id)
+    # Графік — доповнення: збій matplotlib чи пулу не має зривати сам звіт
+    try: chart = await get_trends_chart(user_id)
+    except Exception:
+        logging.exception(f"Не вдалося побудувати графік трендів для user_id={user_id}, звіт без нього:")
+        chart = None
+    # Рендеринг FPDF — чисте CPU, тому виконується в пулі процесів, а не в event loop
+    return await asyncio.get_running_loop().run_in_executor(reports.get_pool(), reports.render_doctor_report, profile, history, datetime.date.today(), chart)
 
 # --- Планувальник та Startup ---
-async def send_weekly_report(bot: Bot, user_id: int):
-    # Ця функція потребує оновлення для роботи з новими даними, поки що заглушка
-    logging.info(f"Спроба генерації тижневого звіту для user_id={user_id}")
+# Усі масові розсилки (нагадування, тижневі звіти) йдуть через одну чергу з лімітами Telegram
+message_sender = MessageSender()
+metrics.sender_queue_depth.set_function(lambda: message_sender.stats["queue_depth"])
 
-async def send_reminder(bot: Bot, user_id: int, med_id: int, med_name: str, dosage: str):
+async def send_reminder(user_id: int, med_id: int, med_name: str, dosage: str, late: float = 0):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Прийнято", callback_data=f"med_log:taken:{med_id}"), InlineKeyboardButton(text="❌ Пропущено", callback_data=f"med_log:skipped:{med_id}")]])
-    try: await bot.send_message(user_id, f"⏰ **Нагадування!**\n\nЧас прийняти ліки: **{med_name}**\nДозування: {dosage}", reply_markup=keyboard)
-    except Exception as e: logging.error(f"Не вдалося надіслати нагадування user_id={user_id}: {e}")
-
-def schedule_reminders(bot: Bot):
-    schedule.clear()
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, med_id, med_name, dosage, schedule FROM medications WHERE is_active = 1")
-    for user_id, med_id, med_name, dosage, schedule_str in cursor.fetchall():
-        for t in re.findall(r"(\d{2}:\d{2})", schedule_str):
-            schedule.every().day.at(t).do(lambda u=user_id, m_id=med_id, m_n=med_name, d=dosage: asyncio.create_task(send_reminder(bot, u, m_id, m_n, d)))
-    cursor.execute("SELECT DISTINCT user_id FROM users") # Розсилаємо всім, хто є в базі
-    for user in cursor.fetchall():
-        schedule.every().sunday.at("10:00").do(lambda u_id=user[0]: asyncio.create_task(send_weekly_report(bot, u_id)))
-    conn.close()
+    text = f"⏰ **Нагадування!**\n\nЧас прийняти ліки: **{med_name}**\nДозування: {dosage}"
+    if late > 120: text += f"\n\n_Нагадування запізнилося на {int(late // 60)} хв через технічну перерву._"
+    await message_sender.send(user_id, text, reply_markup=keyboard)
+
+# Нагадування про ліки живуть у таблиці reminder_slots; в пам'яті — лише фіксовані завдання (тижневі звіти)
+reminder_slots = ReminderSlots(db, send_reminder)
+reminder_scheduler = ReminderScheduler()
+
+# Тижневі дайджести: порції користувачів, зведення з health_rollups, прогрес у weekly_report_runs
+weekly_report_job = WeeklyReportJob(db, message_sender)
+# Щоденні сповіщення про наближення циклу (за даними cycle_stats)
+cycle_forecast_job = CycleForecastJob(db, message_sender)
+# Старі взаємодії з AI щоночі переносяться в стиснутий помісячний архів; читати — через interactions.lookup()
+interactions = InteractionArchive(db)
+
+async def _resume_weekly_reports():
+    # Окремо від циклів нагадувань: помилка дозавершення розсилки не має зупиняти нагадування про ліки
+    try: await weekly_report_job.resume()
+    except Exception: logging.exception("Не вдалося дозавершити тижневу розсилку:")
 
 async def scheduler_loop(bot: Bot):
-    schedule_reminders(bot)
-    while True:
-        schedule.run_pending()
-        await asyncio.sleep(60)
+    reminder_scheduler.add("weekly_reports", "10:00", weekly_report_job.run, weekday=6)
+    reminder_scheduler.add("cycle_forecasts", "09:00", cycle_forecast_job.run)
+    reminder_scheduler.add("archive_interactions", "04:00", interactions.run)
+    # Нагадування і розсилки веде лише один процес — власник lease (решта воркерів чекають на заміну)
+    await sharding.hold_lease(db, "scheduler", lambda: (reminder_slots.run(), reminder_scheduler.run(), _resume_weekly_reports()))
+
+_scheduler_task = None
+
+async def _prewarm():
+    # Важкі залежності довантажуються у фоні, коли бот уже приймає оновлення
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.gather(*(loop.run_in_executor(reports.get_pool(), reports.warm_up) for _ in range(reports.REPORT_WORKERS)), asyncio.to_thread(importlib.import_module, "openai"),
+                             asyncio.to_thread(prompts.load_tokenizer))
+        logging.info(f"Фоновий прогрів (пул звітів, openai, токенізатор) завершено за {time.perf_counter() - started:.2f} с")
+    except Exception: logging.exception("Помилка фонового прогріву:")
 
 async def on_startup(bot: Bot):
-    setup_database()
-    asyncio.create_task(scheduler_loop(bot))
+    with startup.phase("БД і міграції"): await setup_database(), await achievement_engine.load()
+    with startup.phase("планувальник і розсилка"):
+        message_sender.start(bot)
+        global _scheduler_task
+        _scheduler_task = asyncio.create_task(scheduler_loop(bot))
+    if PREWARM: asyncio.create_task(_prewarm())
     logging.info("Бот запущено, базу даних налаштовано, планувальник активовано.")
 
+async def on_shutdown():
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()  # звільняє lease, щоб інший процес одразу перейняв нагадування
+        await asyncio.gather(_scheduler_task, return_exceptions=True)
+    await message_sender.stop()
+    await write_queue.stop()  # гарантовано скидаємо відкладені вставки перед закриттям БД
+    db.close()
+    reports.shutdown_pool()
+
 # --- Клавіатури ---
-def get_main_menu_keyboard(user_id: int):
-    profile, is_female = get_user_profile(user_id), False
-    if profile and profile[2] and profile[2].lower() in ['жіноча', 'female']: is_female = True
+@functools.lru_cache(maxsize=2)
+def _build_main_menu_keyboard(is_female: bool):
     keyboard = [
         [KeyboardButton(text=ANALYZE_BTN_TEXT)],
         [KeyboardButton(text="☀️ Щоденний Check-in"), KeyboardButton(text="📝 Швидкий запис")],
@@ -322,13 +433,19 @@ def get_main_menu_keyboard(user_id: int):
     if is_female: keyboard.insert(2, [KeyboardButton(text="🌸 Жіноче здоров'я")])
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
+async def get_main_menu_keyboard(user_id: int):
+    # Клавіатура залежить лише від статі, тож є всього два готових варіанти
+    profile, is_female = await get_user_profile(user_id), False
+    if profile and profile[2] and profile[2].lower() in ['жіноча', 'female']: is_female = True
+    return _build_main_menu_keyboard(is_female)
+
 cancel_keyboard = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="⬅️ Головне меню")]], resize_keyboard=True)
 
 # --- Обробники (Handlers) ---
 @router.message(F.text == "⬅️ Головне меню")
 async def back_to_main_menu(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Дію скасовано. Ви повернулися в головне меню.", reply_markup=get_main_menu_keyboard(message.from_user.id))
+    await message.answer("Дію скасовано. Ви повернулися в головне меню.", reply_markup=await get_main_menu_keyboard(message.from_user.id))
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
@@ -338,14 +455,14 @@ async def cmd_start(message: Message, state: FSMContext):
 
 @router.callback_query(F.data.in_({"accept_privacy", "skip_privacy"}))
 async def process_privacy_choice(callback: CallbackQuery, state: FSMContext):
-    create_or_update_user(callback.from_user.id, callback.from_user.first_name)
+    await create_or_update_user(callback.from_user.id, callback.from_user.first_name)
     confirmation_text = "Дякуємо за згоду!" if callback.data == "accept_privacy" else "Ви можете ознайомитися з політикою конфіденційності командою /privacy."
     await callback.message.edit_text(confirmation_text)
-    await callback.message.answer("Оберіть дію:", reply_markup=get_main_menu_keyboard(callback.from_user.id))
+    await callback.message.answer("Оберіть дію:", reply_markup=await get_main_menu_keyboard(callback.from_user.id))
 
 @router.message(Command("sos"))
 async def cmd_sos(message: Message):
-    profile_data = get_user_profile(message.from_user.id)
+    profile_data = await get_user_profile(message.from_user.id)
     if not profile_data: return await message.answer("Профіль не знайдено.")
     _, _, _, _, _, blood, allergies, chronic, contact = profile_data
     sos_text = (f"**🚑 Ваша Екстрена картка:**\n\n**Група крові:** {blood or 'Не вказано'}\n**Алергії:** {allergies or 'Не вказано'}\n**Хронічні захворювання:** {chronic or 'Не вказано'}\n**Екстрений контакт:** {contact or 'Не вказано'}")
@@ -353,7 +470,7 @@ async def cmd_sos(message: Message):
     
 @router.message(F.text == "👤 Мій профіль")
 async def show_profile(message: Message, state: FSMContext):
-    profile_data = get_user_profile(message.from_user.id)
+    profile_data = await get_user_profile(message.from_user.id)
     if not profile_data: return await message.answer("Помилка. Спробуйте /start")
     name, age, gender, weight, height, _, _, _, _ = profile_data
     profile_text = (f"**👤 Ваш профіль:**\n\nІм'я: {name}\nВік: {age or 'Не вказано'}\nСтать: {gender or 'Не вказано'}\nВага: {f'{weight} кг' if weight else 'Не вказано'}\nЗріст: {f'{height} см' if height else 'Не вказано'}")
@@ -384,9 +501,9 @@ async def process_field_update(message: Message, state: FSMContext):
     field, value = user_data.get("field_to_edit"), message.text
     if field in ['age', 'weight_kg', 'height_cm'] and not value.replace('.', '', 1).isdigit(): return await message.answer("Будь ласка, введіть числове значення.")
     if field == 'gender' and value.lower() not in ['жіноча', 'чоловіча', 'female', 'male']: return await message.answer("Будь ласка, введіть 'жіноча' або 'чоловіча'.")
-    update_user_field(message.from_user.id, field, value)
+    await update_user_field(message.from_user.id, field, value)
     await state.clear()
-    await message.answer("✅ Дані оновлено.", reply_markup=get_main_menu_keyboard(message.from_user.id))
+    await message.answer("✅ Дані оновлено.", reply_markup=await get_main_menu_keyboard(message.from_user.id))
     await show_profile(message, state)
 
 for field_name in ["age", "gender", "weight_kg", "height_cm", "blood_group", "allergies", "chronic_diseases", "emergency_contact"]:
@@ -399,7 +516,7 @@ async def back_to_profile_view(callback: CallbackQuery, state: FSMContext):
 
 @router.message(F.text == "💊 Мої ліки")
 async def show_meds(message: Message, state: FSMContext):
-    meds = get_user_medications(message.from_user.id)
+    meds = await get_user_medications(message.from_user.id)
     text = "**💊 Ваші ліки:**\n\n" if meds else "У вас немає доданих ліків."
     if meds: text += "\n".join([f"• **{name}** ({dosage})\n   └ Розклад: {schedule} /del{med_id}" for med_id, name, dosage, schedule in meds])
     await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="➕ Додати ліки", callback_data="add_medication")]]))
@@ -419,20 +536,23 @@ async def process_med_dosage(message: Message, state: FSMContext):
 @router.message(Form.add_med_schedule)
 async def process_med_schedule(message: Message, state: FSMContext, bot: Bot):
     if not re.match(r"^\d{2}:\d{2}(,\s*\d{2}:\d{2})*$", message.text): return await message.answer("Неправильний формат. Введіть час як 'HH:MM'.")
+    try: [parse_hhmm(t) for t in message.text.split(",")]
+    except ValueError: return await message.answer("Неправильний час. Години мають бути від 00 до 23, хвилини — від 00 до 59.")
     data = await state.get_data()
-    add_medication(message.from_user.id, data['name'], data['dosage'], message.text)
-    await message.answer(f"✅ Ліки '{data['name']}' додано.", reply_markup=get_main_menu_keyboard(message.from_user.id))
-    await state.clear(), schedule_reminders(bot), await show_meds(message, state)
+    await add_medication(message.from_user.id, data['name'], data['dosage'], message.text)
+    reminder_slots.notify()
+    await message.answer(f"✅ Ліки '{data['name']}' додано.", reply_markup=await get_main_menu_keyboard(message.from_user.id))
+    await state.clear(), await show_meds(message, state)
 
 @router.message(F.text.startswith("/del"))
 async def delete_med(message: Message, bot: Bot):
-    try: set_medication_inactive(int(message.text[4:]), message.from_user.id), await message.answer(f"Ліки видалено з активних."), schedule_reminders(bot)
+    try: await set_medication_inactive(int(message.text[4:]), message.from_user.id), await message.answer(f"Ліки видалено з активних.")
     except (ValueError, IndexError): await message.answer("Неправильний формат. Використовуйте /del<ID>.")
 
 @router.callback_query(F.data.startswith("med_log:"))
 async def log_med_status(callback: CallbackQuery):
     _, status, med_id_str = callback.data.split(":")
-    log_medication_status(callback.from_user.id, int(med_id_str), status)
+    await log_medication_status(callback.from_user.id, int(med_id_str), status)
     status_text = "Прийнято" if status == "taken" else "Пропущено"
     await callback.message.edit_text(f"Відзначено: **{status_text}**"), await callback.answer(f"Статус оновлено: {status_text}")
 
@@ -443,39 +563,118 @@ async def ask_for_note(message: Message, state: FSMContext):
 
 @router.message(Form.waiting_for_note)
 async def process_note(message: Message, state: FSMContext):
-    save_health_entry(user_id=message.from_user.id, note=message.text)
+    await save_health_entry(user_id=message.from_user.id, note=message.text)
     await state.clear()
-    await message.answer("✅ Нотатку збережено.", reply_markup=get_main_menu_keyboard(message.from_user.id))
-    await award_achievement(message.from_user.id, 'FIRST_NOTE', message)
+    await message.answer("✅ Нотатку збережено.", reply_markup=await get_main_menu_keyboard(message.from_user.id))
+    await award_achievements(message.from_user.id, "note", message)
 
 @router.message(F.text == "📄 Створити звіт")
 async def cmd_create_report(message: Message):
+    user_id = message.from_user.id
+    if user_id in _reports_in_progress: return await message.answer("Ваш попередній звіт ще готується, зачекайте, будь ласка.")
+    _reports_in_progress.add(user_id)
     await message.answer("Починаю готувати ваш звіт... ⏳")
     try:
-        if report_path := generate_doctor_report_pdf(message.from_user.id):
-            await message.answer_document(types.FSInputFile(report_path), caption="Ваш звіт готовий.")
-            if os.path.exists(report_path): os.remove(report_path)
-            await award_achievement(message.from_user.id, 'FIRST_REPORT', message)
+        if report_bytes := await generate_doctor_report_pdf(user_id):
+            await message.answer_document(types.BufferedInputFile(report_bytes, filename=f"report_{user_id}.pdf"), caption="Ваш звіт готовий.")
+            await award_achievements(user_id, "report", message)
         else: await message.answer("Недостатньо даних для створення звіту.")
     except Exception as e:
         logging.exception("Помилка при генерації звіту:"), await message.answer("Вибачте, сталася помилка.")
+    finally:
+        _reports_in_progress.discard(user_id)
+
+@router.message(Command("trends"))
+async def cmd_trends(message: Message):
+    if not (chart := await get_trends_chart(message.from_user.id)): return await message.answer("Поки що недостатньо даних для графіків. Проходьте щоденний check-in, і тренди з'являться тут.")
+    await message.answer_photo(types.BufferedInputFile(chart, filename="trends.png"), caption="📈 Ваші тренди за останній рік")
+
+# --- Історія записів ---
+# Запас від ліміту Telegram у 4096 символів; надто довгі нотатки скорочуються
+HISTORY_TEXT_LIMIT = 4000
+HISTORY_NOTE_LIMIT = 500
+# Відповіді check-in — теж довільний текст; з обмеженнями полів навіть один запис вміщується в повідомлення
+HISTORY_FIELD_LIMIT = 100
+
+def _pack_ts(value: str) -> str:
+    # '2024-05-01 10:00:00' -> '20240501100000', щоб курсор вмістився в 64 байти callback_data
+    return re.sub(r"\D", "", value or "")
+
+def _unpack_ts(value: str):
+    if not value: return None
+    value = value.ljust(14, "0")
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]} {value[8:10]}:{value[10:12]}:{value[12:14]}"
+
+def _clip_html(value: str, limit: int) -> str:
+    # Обрізаємо вже екрановане значення (& < > роздувають текст), не розриваючи сутність на кшталт &amp;
+    text = html.escape(value)
+    return text if len(text) <= limit else re.sub(r"&[^;]*$", "", text[:limit]) + "…"
+
+def _format_history_entry(row) -> str:
+    _, timestamp, mood, sleep, note, activity, stress, water = row
+    lines = [f"🗓️ <b>{datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').strftime('%d-%m-%y %H:%M')}</b>"]
+    if note: lines.append(f"   - 📝 Нотатка: {_clip_html(note, HISTORY_NOTE_LIMIT)}")
+    for label, value in (("Настрій", mood), ("Сон", sleep), ("Активність", activity), ("Стрес", stress), ("Вода", water)):
+        if value: lines.append(f"   - {label}: {_clip_html(value, HISTORY_FIELD_LIMIT)}")
+    return "\n".join(lines) + "\n---"
+
+async def render_history_page(user_id: int, cursor=None, newer: bool = False, date_from: str = None, date_to: str = None):
+    rows = await get_history_page(user_id, cursor, newer, date_from, date_to)
+    has_more, rows = len(rows) > HISTORY_PAGE_SIZE, rows[:HISTORY_PAGE_SIZE]
+    header = "<b>Записи про здоров'я</b>"
+    if date_from or date_to:
+        last_day = datetime.datetime.strptime(date_to, '%Y-%m-%d %H:%M:%S') - datetime.timedelta(days=1) if date_to else None
+        header += f" ({datetime.datetime.strptime(date_from, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y') if date_from else '…'} — {last_day.strftime('%d.%m.%Y') if last_day else '…'})"
+    blocks, size = [], len(header)
+    for row in rows:
+        block = _format_history_entry(row)
+        if blocks and size + len(block) + 1 > HISTORY_TEXT_LIMIT:
+            has_more = True  # решта рядків піде на наступну сторінку
+            break
+        blocks.append(block)
+        size += len(block) + 1
+    shown = rows[:len(blocks)]
+    if newer: shown, blocks = shown[::-1], blocks[::-1]
+    has_older, has_newer = (True, has_more) if newer else (has_more, cursor is not None)
+    if not blocks: return ("Ваша історія записів порожня." if not (date_from or date_to or cursor) else "За вибраний період записів немає."), _history_keyboard(None, None, False, False, date_from, date_to)
+    return header + "\n\n" + "\n".join(blocks), _history_keyboard(shown[0], shown[-1], has_older, has_newer, date_from, date_to)
+
+def _history_keyboard(newest, oldest, has_older: bool, has_newer: bool, date_from: str, date_to: str):
+    period = f"{_pack_ts(date_from)[:8]}:{_pack_ts(date_to)[:8]}"
+    nav = []
+    if has_older: nav.append(InlineKeyboardButton(text="◀️ Старіші", callback_data=f"hist:o:{_pack_ts(oldest[1])}:{oldest[0]}:{period}"))
+    if has_newer: nav.append(InlineKeyboardButton(text="Новіші ▶️", callback_data=f"hist:n:{_pack_ts(newest[1])}:{newest[0]}:{period}"))
+    ranges = [InlineKeyboardButton(text=text, callback_data=f"hist:r:{days}") for text, days in (("📅 7 днів", 7), ("📅 30 днів", 30), ("📅 Усі", 0))]
+    return InlineKeyboardMarkup(inline_keyboard=[nav, ranges] if nav else [ranges])
+
+def _parse_history_period(args: str):
+    """'/history 01.01.2024 31.03.2024' -> межі [date_from, date_to) у форматі timestamp."""
+    dates = [datetime.datetime.strptime(d, "%d.%m.%Y") for d in (args or "").split()[:2]]
+    date_from = dates[0].strftime('%Y-%m-%d %H:%M:%S') if dates else None
+    date_to = (dates[1] + datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S') if len(dates) > 1 else None
+    return date_from, date_to
 
 @router.message(F.text == "📖 Переглянути історію")
-async def view_history(message: Message):
-    if not (history := get_user_history(message.from_user.id)): return await message.answer("Ваша історія записів порожня.")
-    response = "**Останні записи про здоров'я:**\n\n"
-    for record in history:
-        timestamp, mood, sleep, note, activity, stress, water = record
-        dt_object = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        response += f"🗓️ **{dt_object.strftime('%d-%m-%y %H:%M')}**\n"
-        if note: response += f"   - 📝 Нотатка: {note}\n"
-        if mood: response += f"   - Настрій: {mood}\n"
-        if sleep: response += f"   - Сон: {sleep}\n"
-        if activity: response += f"   - Активність: {activity}\n"
-        if stress: response += f"   - Стрес: {stress}\n"
-        if water: response += f"   - Вода: {water}\n"
-        response += "---\n"
-    await message.answer(response)
+@router.message(Command("history"))
+async def view_history(message: Message, command: CommandObject = None):
+    try: date_from, date_to = _parse_history_period(command.args if command else None)
+    except ValueError: return await message.answer("Вкажіть період у форматі: /history 01.01.2024 31.03.2024")
+    text, keyboard = await render_history_page(message.from_user.id, date_from=date_from, date_to=date_to)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("hist:"))
+async def paginate_history(callback: CallbackQuery):
+    parts = callback.data.split(":")
+    if parts[1] == "r":
+        days = int(parts[2])
+        date_from = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)).strftime('%Y-%m-%d 00:00:00') if days else None
+        text, keyboard = await render_history_page(callback.from_user.id, date_from=date_from)
+    else:
+        _, direction, ts, entry_id, date_from, date_to = parts
+        text, keyboard = await render_history_page(callback.from_user.id, (_unpack_ts(ts), int(entry_id)), direction == "n", _unpack_ts(date_from), _unpack_ts(date_to))
+    try: await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest: pass  # та сама сторінка — повідомлення не змінилось
+    await callback.answer()
 
 @router.message(F.text == "☀️ Щоденний Check-in")
 async def start_checkin(message: Message, state: FSMContext):
@@ -514,92 +713,101 @@ async def process_checkin_stress(message: Message, state: FSMContext):
 async def process_checkin_water(message: Message, state: FSMContext):
     await state.update_data(water_intake=message.text)
     data = await state.get_data()
-    save_health_entry(user_id=message.from_user.id, **data)
+    await save_health_entry(user_id=message.from_user.id, **data)
     recommendation = generate_daily_recommendation(data)
-    await message.answer(recommendation, reply_markup=get_main_menu_keyboard(message.from_user.id))
+    await message.answer(recommendation, reply_markup=await get_main_menu_keyboard(message.from_user.id))
     
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT checkin_streak, last_checkin_date FROM users WHERE user_id = ?", (message.from_user.id,))
-    streak_data = cursor.fetchone()
-    current_streak, last_date_str = (streak_data[0] or 0, streak_data[1]) if streak_data else (0, None)
-    today, new_streak = datetime.date.today(), current_streak
-    
-    if last_date_str:
-        last_date = datetime.datetime.strptime(last_date_str, '%Y-%m-%d').date()
-        delta = today - last_date
-        if delta.days == 1: new_streak += 1
-        elif delta.days > 1: new_streak = 1
-    else: new_streak = 1
-    cursor.execute("UPDATE users SET checkin_streak = ?, last_checkin_date = ? WHERE user_id = ?", (new_streak, today.strftime('%Y-%m-%d'), message.from_user.id))
-    conn.commit(), conn.close()
+    new_streak = await update_checkin_streak(message.from_user.id)
     
     await state.clear()
     
     if new_streak > 1: await message.answer(f"🔥 Ви ведете щоденник вже **{new_streak}** днів поспіль!")
-    if new_streak >= 5: await award_achievement(message.from_user.id, 'STREAK_5_DAYS', message)
+    await award_achievements(message.from_user.id, "checkin", message, value=new_streak)
 
 @router.message(F.text == "🌸 Жіноче здоров'я")
 async def show_cycle_menu(message: Message):
-    avg_len, next_date = get_cycle_predictions(message.from_user.id)
-    text = f"Ваша середня тривалість циклу: ~{avg_len} днів.\nОрієнтовний початок наступного циклу: **{next_date}**." if avg_len else "Даних для прогнозу ще недостатньо."
+    if prediction := await get_cycle_predictions(message.from_user.id):
+        mean, spread, next_date, confidence = prediction
+        text = (f"Ваша середня тривалість циклу: ~{round(mean)} днів.\nОрієнтовний початок наступного циклу: <b>{next_date.strftime('%d-%m-%Y')}</b>"
+                f" (±{max(1, round(spread))} дн., точність прогнозу {round(confidence * 100)}%).")
+    else: text = "Даних для прогнозу ще недостатньо."
     await message.answer(f"{text}\n\nОберіть дію:", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🩸 Почався сьогодні", callback_data="cycle:start")], [InlineKeyboardButton(text="🩸 Закінчився сьогодні", callback_data="cycle:end")]]))
 
 @router.callback_query(F.data == "cycle:start")
 async def process_cycle_start(callback: CallbackQuery):
-    start_new_cycle(callback.from_user.id), await callback.answer("✅ Новий цикл розпочато.", show_alert=True), await callback.message.delete()
+    await start_new_cycle(callback.from_user.id), await callback.answer("✅ Новий цикл розпочато.", show_alert=True), await callback.message.delete()
 
 @router.callback_query(F.data == "cycle:end")
 async def process_cycle_end(callback: CallbackQuery):
-    await callback.answer("✅ Поточний цикл завершено." if end_current_cycle(callback.from_user.id) else "❗️ У вас немає активного циклу.", show_alert=True), await callback.message.delete()
+    await callback.answer("✅ Поточний цикл завершено." if await end_current_cycle(callback.from_user.id) else "❗️ У вас немає активного циклу.", show_alert=True), await callback.message.delete()
     
-async def process_symptoms_generic(message: Message, state: FSMContext, openai_client: AsyncOpenAI, symptoms_text: str):
-    await message.answer("Аналізую інформацію... ⏳", reply_markup=get_main_menu_keyboard(message.from_user.id))
-    await state.update_data(initial_symptoms=symptoms_text)
-    profile_data = get_user_profile(message.from_user.id)
+async def process_symptoms_generic(message: Message, state: FSMContext, ai_client: ResilientAIClient, symptoms_text: str = None, conversation: dict = None):
+    # chat.id, а не from_user.id: для кнопок-колбеків message надісланий ботом (приватний чат = id користувача)
+    user_id = message.chat.id
+    await message.answer("Аналізую інформацію... ⏳", reply_markup=await get_main_menu_keyboard(user_id))
+    conversation = conversation or prompts.new_conversation(symptoms_text)
+    profile_data = await get_user_profile(user_id)
     profile_text, emergency_text = "Дані профілю не вказані.", ""
+    age = gender = allergies = chronic = None
     if profile_data:
         _, age, gender, weight, height, _, allergies, chronic, _ = profile_data
         profile_text = f"Вік: {age or 'N/A'}. Стать: {gender or 'N/A'}. Вага: {weight or 'N/A'} кг. Зріст: {height or 'N/A'} см."
         if allergies: emergency_text += f"Алергії пацієнта: {allergies}.\n"
         if chronic: emergency_text += f"Хронічні захворювання пацієнта: {chronic}.\n"
-    # med_bot_aiogram.py (всередині process_symptoms_generic)
-
-    system_prompt = (
-        "Ти - досвідчений медичний AI-асистент. Твоя мета - допомогти користувачеві з попереднім аналізом його стану здоров'я.\n"
-        "--- НОВІ ІНСТРУКЦІЇ ПРО СТИЛЬ ---\n"
-        "**Спілкуйся простою та зрозумілою мовою, як турботливий, але професійний помічник.**\n"
-        "**Уникай надто складних медичних термінів.** Пояснюй так, ніби говориш зі звичайною людиною, а не з лікарем.\n"
-        "**Структуруй відповідь логічно, а не просто сухим переліком.** Наприклад: 'Ви скаржитесь на [симптом]. Це може вказувати на кілька речей. Найчастіше це буває через...'\n"
-        "--- КІНЕЦЬ НОВИХ ІНСТРУКЦІЙ ---\n"
-        "- Проаналізуй симптоми користувача в контексті його профілю.\n"
-        "- **ДУЖЕ ВАЖЛИВО:** Обов'язково враховуй вказані алергії та хронічні захворювання пацієнта при аналізі.\n"
-        "- Сформулюй 3-4 найбільш імовірні причини.\n"
-        "- Запропонуй загальні рекомендації (відпочинок, рідина).\n"
-        "- Додай розділ '**Можливі напрямки лікування, які варто обговорити з лікарем:**', дотримуючись правил безпеки (без назв ліків та дозувань).\n"
-        "- Якщо симптоми серйозні, порадь НЕГАЙНО звернутися до лікаря.\n"
-        "- ЗАВЖДИ закінчуй усю відповідь фразою: \"Пам'ятайте, цей аналіз не є діагнозом. Для точної діагностики зверніться до лікаря.\"\n"
-        "- Якщо інформації недостатньо, постав ОДНЕ коротке уточнююче питання."
-    )
-    user_prompt = f"Профіль пацієнта: {profile_text}\n\n{emergency_text}Проаналізуй наступні скарги пацієнта: «{symptoms_text}»"
+    # Системний промпт — незмінний префікс; уточнення йдуть окремими репліками в межах бюджету токенів
+    messages, prompt_tokens = prompts.build_messages(conversation, profile_text, emergency_text)
+    user_prompt = "\n\n".join(m["content"] for m in messages[1:])
+
+    streamed = False
+
+    async def request_model(model: str):
+        nonlocal streamed
+        started, outcome = time.perf_counter(), "error"
+        metrics.ai_prompt_tokens.observe(prompt_tokens)
+        try:
+            if AI_STREAMING:
+                stream = await ai_client.client.chat.completions.create(model=model, messages=messages, stream=True)
+                streamed = True
+                result = await stream_to_message(message, stream)
+            else:
+                completion = await ai_client.client.chat.completions.create(model=model, messages=messages)
+                result = completion.choices[0].message.content
+            outcome = "ok"
+            logging.info(f"AI-запит {model} (user_id={user_id}): промпт {prompt_tokens} токенів, відповідь {prompts.count_tokens(result)}, уточнень {len(conversation['turns'])}")
+            return result
+        finally: metrics.ai_request_latency.observe(time.perf_counter() - started, model=model, stream=str(AI_STREAMING).lower(), outcome=outcome)
+
+    async def request_completion():
+        return await ai_client.run(user_id, request_model)
+
     try:
-        completion = await openai_client.chat.completions.create(model="openai/gpt-4o-mini", messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}])
-        response_text = completion.choices[0].message.content
-        save_openai_interaction(message.from_user.id, user_prompt, response_text)
+        cache_key = ai_cache.make_key(AI_MODEL, prompts.SYSTEM_PROMPT, prompts.cache_text(conversation), age, gender, allergies, chronic)
+        response_text = await ai_response_cache.get_or_create(cache_key, request_completion)
+        await save_openai_interaction(user_id, user_prompt, response_text)
         if "?" in response_text and len(response_text) < 300:
-            await state.set_state(Form.answering_clarification)
-            await message.answer(response_text, reply_markup=cancel_keyboard)
+            prompts.add_question(conversation, response_text)
+            await state.set_state(Form.answering_clarification), await state.update_data(conversation=conversation)
+            # Відредаговане повідомлення не може отримати reply-клавіатуру, тому для неї окрема підказка
+            if streamed: await message.answer("Напишіть відповідь на уточнююче питання ✍️", reply_markup=cancel_keyboard)
+            else: await message.answer(response_text, reply_markup=cancel_keyboard)
         else:
-            await message.answer(response_text), await state.clear()
+            if not streamed: await message.answer(response_text)
+            await state.clear()
+    except AIBusyError:
+        await message.answer("Ваш попередній запит ще аналізується, зачекайте, будь ласка.")
+    except AIUnavailableError as e:
+        logging.error(f"AI недоступний: {e}"), await state.clear()
+        await message.answer("😔 AI-аналіз зараз тимчасово недоступний. Спробуйте, будь ласка, за кілька хвилин.\nЯкщо стан серйозний — не чекайте, зверніться до лікаря.")
     except Exception as e:
         logging.error(f"Помилка OpenAI: {e}"), await message.answer("На жаль, сталася помилка."), await state.clear()
 
 @router.message(Form.answering_clarification)
-async def process_clarification_answer(message: Message, state: FSMContext, openai_client: AsyncOpenAI):
-    user_answer, user_data = message.text, await state.get_data()
-    original_symptoms = user_data.get("initial_symptoms", "")
-    combined_text = f"{original_symptoms}\n\nУточнення від пацієнта: {user_answer}"
-    await process_symptoms_generic(message, state, openai_client, combined_text)
+async def process_clarification_answer(message: Message, state: FSMContext, ai_client: ResilientAIClient):
+    user_data = await state.get_data()
+    # initial_symptoms — стан, збережений до появи структурованого діалогу
+    conversation = user_data.get("conversation") or prompts.new_conversation(user_data.get("initial_symptoms", ""))
+    prompts.add_answer(conversation, message.text)
+    await process_symptoms_generic(message, state, ai_client, conversation=conversation)
     
 @router.message(F.text == ANALYZE_BTN_TEXT)
 async def start_symptom_checker(message: Message, state: FSMContext):
@@ -607,17 +815,17 @@ async def start_symptom_checker(message: Message, state: FSMContext):
     await message.answer("Оберіть основний симптом або опишіть його:", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🤯 Головний біль", callback_data="symptom:headache")], [InlineKeyboardButton(text="🤒 Біль у горлі", callback_data="symptom:sore_throat")], [InlineKeyboardButton(text="📝 Інше (описати текстом)", callback_data="symptom:other")]]))
 
 @router.message(Form.symptom_checker_start)
-async def process_other_symptom_text(message: Message, state: FSMContext, openai_client: AsyncOpenAI):
-    await process_symptoms_generic(message, state, openai_client, message.text)
+async def process_other_symptom_text(message: Message, state: FSMContext, ai_client: ResilientAIClient):
+    await process_symptoms_generic(message, state, ai_client, message.text)
     
 @router.callback_query(F.data == 'symptom:other', Form.symptom_checker_start)
 async def ask_for_other_symptom(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer("Будь ласка, опишіть ваші симптоми одним повідомленням.", reply_markup=cancel_keyboard), await callback.answer()
 
 @router.callback_query(F.data == 'symptom:sore_throat', Form.symptom_checker_start)
-async def process_sore_throat(callback: CallbackQuery, state: FSMContext, openai_client: AsyncOpenAI):
+async def process_sore_throat(callback: CallbackQuery, state: FSMContext, ai_client: ResilientAIClient):
     await callback.message.delete()
-    await process_symptoms_generic(callback.message, state, openai_client, "Основний симптом: біль у горлі."), await callback.answer()
+    await process_symptoms_generic(callback.message, state, ai_client, "Основний симптом: біль у горлі."), await callback.answer()
 
 @router.callback_query(F.data == 'symptom:headache', Form.symptom_checker_start)
 async def ask_headache_type(callback: CallbackQuery, state: FSMContext):
@@ -635,11 +843,11 @@ async def ask_headache_additional(message: Message, state: FSMContext):
     await message.answer("Чи є у вас інші симптоми? (напр., 'нудота')\nЯкщо ні, напишіть 'немає'.", reply_markup=cancel_keyboard)
 
 @router.message(Form.symptom_checker_headache_additional)
-async def process_headache_final(message: Message, state: FSMContext, openai_client: AsyncOpenAI):
+async def process_headache_final(message: Message, state: FSMContext, ai_client: ResilientAIClient):
     await state.update_data(additional_symptoms=message.text)
     user_data = await state.get_data()
     prompt = (f"Основний симптом: {user_data.get('main_symptom')}.\n"
               f"Характер болю: {user_data.get('headache_type')}.\n"
               f"Локалізація: {user_data.get('headache_location')}.\n"
               f"Додаткові симптоми: {user_data.get('additional_symptoms')}.")
-    await process_symptoms_generic(message, state, openai_client, prompt)
\ No newline at end of file
+    await process_symptoms_generic(message, state, ai_client, prompt)
\ No newline at end of file
@@ -0,0 +1,176 @@
+# metrics.py — метрики у форматі Prometheus (text exposition 0.0.4) без зовнішніх залежностей
+
+import bisect
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra: pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value): return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        # Оновлення надходять і з потоків БД, тож зміни значень серіалізуються
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        with self._lock: items = list(self._values.items())
+        for key, value in items: yield "", key, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, value, *extra in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, key, *extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = value
+
+    def set_function(self, function):
+        """Значення без міток, що обчислюється в момент збору (глибина черги тощо)."""
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try: yield "", (), self.function()
+            except Exception: logging.exception(f"Помилка обчислення метрики {self.name}:")
+        yield from super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key, index = self._key(labels), bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (state := self._values.get(key)) is None: state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock: items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", key, cumulative, f'le="{_format_value(bound)}"'
+            yield "_sum", key, total
+            yield "_count", key, cumulative
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# --- Метрики бота ---
+handler_latency = Histogram("bot_handler_seconds", "Час виконання обробника", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Винятки в обробниках", ("handler", "error"))
+db_helper_latency = Histogram("bot_db_helper_seconds", "Час DB-хелпера разом з очікуванням у пулі", ("helper",))
+db_query_latency = Histogram("bot_db_query_seconds", "Час виконання функції в з'єднанні SQLite", ("function", "mode"))
+ai_request_latency = Histogram("bot_ai_request_seconds", "Час запиту chat.completions (з потоком — до останнього токена)", ("model", "stream", "outcome"))
+ai_prompt_tokens = Histogram("bot_ai_prompt_tokens", "Токенів у промпті запиту до AI", (), (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000))
+reminder_lateness = Histogram("bot_reminder_lateness_seconds", "Запізнення нагадувань відносно запланованого часу", (), (1, 5, 15, 60, 300, 900, 3600, 6 * 3600))
+reminder_last_lateness = Gauge("bot_reminder_last_lateness_seconds", "Запізнення останнього надісланого нагадування", ("kind",))
+sender_queue_depth = Gauge("bot_sender_queue_depth", "Повідомлень у черзі розсилки")
+write_queue_depth = Gauge("bot_write_queue_depth", "Відкладених вставок у WriteBehindQueue")
+ai_in_flight = Gauge("bot_ai_in_flight", "Запитів до AI, що виконуються")
+
+
+def db_timed(fn):
+    """Декоратор асинхронних DB-хелперів: гістограма bot_db_helper_seconds{helper=...}."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with db_helper_latency.time(helper=fn.__name__): return await fn(*args, **kwargs)
+    return wrapper
+
+
+def observe_db_call(function: str, write: bool, seconds: float):
+    db_query_latency.observe(seconds, function=function, mode="write" if write else "read")
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внутрішній middleware роутера: латентність і помилки для кожного обробника."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try: return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(handler=name, error=type(e).__name__)
+            raise
+        finally: handler_latency.observe(time.perf_counter() - started, handler=name)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_http_server(host: str, port: int, path: str = "/metrics"):
+    """Окремий HTTP-сервер для /metrics (у всіх режимах, не на публічному порту webhook). Повертає AppRunner для cleanup()."""
+    app = web.Application()
+    app.router.add_get(path, handle_metrics)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики доступні на http://{host}:{port}{path}")
+    return runner
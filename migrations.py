@@ -0,0 +1,43 @@
+# migrations.py — версіоновані міграції схеми БД
+
+import logging
+import sqlite3
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str):
+    # Замість try/except навколо ALTER: справжні помилки (заблокована БД, синтаксис) не ковтаються
+    if column not in table_columns(conn, table): conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations) -> list:
+    """Застосовує кроки (version, description, step(conn)), яких ще немає в schema_version.
+
+    Кожен крок виконується в окремій транзакції BEGIN IMMEDIATE разом із записом версії,
+    тож невдалий крок відкочується повністю, а кілька процесів, що стартують одночасно,
+    не застосують одну міграцію двічі. Повертає список застосованих версій.
+    """
+    versions = [version for version, _, _ in migrations]
+    if versions != sorted(set(versions)): raise ValueError("Версії міграцій мають бути унікальними і зростаючими")
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    if conn.in_transaction: conn.commit()
+    done = {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+    applied = []
+    for version, description, step in migrations:
+        if version in done: continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone() is None:
+                step(conn)
+                conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+                applied.append(version)
+                logging.info(f"Застосовано міграцію {version}: {description}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.exception(f"Міграція {version} ({description}) не вдалася:")
+            raise
+    return applied
@@ -0,0 +1,121 @@
+# prompts.py — промпт аналізу симптомів: незмінний системний префікс, стан діалогу уточнень, бюджет токенів
+
+import logging
+import os
+
+# Системний промпт однаковий для всіх запитів і завжди йде першим — провайдер може кешувати цей префікс.
+# Усе змінне (профіль, скарги, уточнення) — лише в повідомленнях після нього
+SYSTEM_PROMPT = (
+    "Ти - досвідчений медичний AI-асистент. Твоя мета - допомогти користувачеві з попереднім аналізом його стану здоров'я.\n"
+    "--- НОВІ ІНСТРУКЦІЇ ПРО СТИЛЬ ---\n"
+    "**Спілкуйся простою та зрозумілою мовою, як турботливий, але професійний помічник.**\n"
+    "**Уникай надто складних медичних термінів.** Пояснюй так, ніби говориш зі звичайною людиною, а не з лікарем.\n"
+    "**Структуруй відповідь логічно, а не просто сухим переліком.** Наприклад: 'Ви скаржитесь на [симптом]. Це може вказувати на кілька речей. Найчастіше це буває через...'\n"
+    "--- КІНЕЦЬ НОВИХ ІНСТРУКЦІЙ ---\n"
+    "- Проаналізуй симптоми користувача в контексті його профілю.\n"
+    "- **ДУЖЕ ВАЖЛИВО:** Обов'язково враховуй вказані алергії та хронічні захворювання пацієнта при аналізі.\n"
+    "- Сформулюй 3-4 найбільш імовірні причини.\n"
+    "- Запропонуй загальні рекомендації (відпочинок, рідина).\n"
+    "- Додай розділ '**Можливі напрямки лікування, які варто обговорити з лікарем:**', дотримуючись правил безпеки (без назв ліків та дозувань).\n"
+    "- Якщо симптоми серйозні, порадь НЕГАЙНО звернутися до лікаря.\n"
+    "- ЗАВЖДИ закінчуй усю відповідь фразою: \"Пам'ятайте, цей аналіз не є діагнозом. Для точної діагностики зверніться до лікаря.\"\n"
+    "- Якщо інформації недостатньо, постав ОДНЕ коротке уточнююче питання."
+)
+# Бюджет усього промпту разом із системним; понад нього старі уточнення згортаються і обрізаються
+PROMPT_TOKEN_BUDGET = int(os.environ.get("AI_PROMPT_TOKEN_BUDGET", "1500"))
+# Скільки останніх пар «питання — відповідь» іде окремими репліками; старіші — у короткий підсумок
+RECENT_TURNS = 2
+# Після стількох уточнень модель просять дати остаточний аналіз
+MAX_CLARIFICATIONS = 3
+MIN_SYMPTOMS_TOKENS = 64
+# Службові токени чат-формату на кожне повідомлення
+MESSAGE_OVERHEAD = 4
+# Файл tokenizer.json або репозиторій Hugging Face з токенізатором моделі
+AI_TOKENIZER = os.environ.get("AI_TOKENIZER", "Xenova/gpt-4o")
+
+_tokenizer = None
+
+
+def load_tokenizer():
+    """Завантажує токенізатор (пакет tokenizers). Може йти в мережу, тому викликається в потоці під час прогріву."""
+    global _tokenizer
+    try:
+        from tokenizers import Tokenizer
+        _tokenizer = Tokenizer.from_file(AI_TOKENIZER) if os.path.exists(AI_TOKENIZER) else Tokenizer.from_pretrained(AI_TOKENIZER)
+        logging.info(f"Токенізатор {AI_TOKENIZER} завантажено")
+    except Exception as e: logging.warning(f"Токенізатор {AI_TOKENIZER} недоступний ({e}), токени рахуються наближено")
+
+
+def count_tokens(text: str) -> int:
+    if not text: return 0
+    if _tokenizer is not None: return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    # Наближено, доки токенізатор не завантажено: ~4 байти UTF-8 на токен (літера кирилиці — 2 байти)
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def count_messages(messages) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0: return ""
+    while count_tokens(text) > max_tokens:
+        text = text[:int(len(text) * 0.8)].rsplit(" ", 1)[0].rstrip(" ,.;") + "…"
+    return text
+
+
+# --- Стан діалогу (зберігається в даних FSM, тож лише JSON-сумісні типи) ---
+def new_conversation(symptoms: str) -> dict:
+    return {"symptoms": symptoms, "turns": []}
+
+
+def add_question(conversation: dict, question: str):
+    conversation["turns"].append({"question": question, "answer": None})
+
+
+def add_answer(conversation: dict, answer: str):
+    if conversation["turns"] and conversation["turns"][-1]["answer"] is None: conversation["turns"][-1]["answer"] = answer
+    else: conversation["turns"].append({"question": "", "answer": answer})
+
+
+def cache_text(conversation: dict) -> str:
+    """Текст для ключа кешу відповідей: скарги і всі відповіді на уточнення."""
+    return "\n".join([conversation["symptoms"]] + [turn["answer"] for turn in conversation["turns"] if turn["answer"]])
+
+
+def _summary(turns, max_tokens=None) -> str:
+    text = "; ".join(f"«{turn['question']}» — {turn['answer']}" if turn["question"] else turn["answer"] for turn in turns)
+    return truncate(text, max_tokens) if max_tokens is not None else text
+
+
+def _assemble(profile_text: str, emergency_text: str, symptoms: str, summary: str, turns, final: bool) -> list:
+    first = f"Профіль пацієнта: {profile_text}\n\n{emergency_text}Проаналізуй наступні скарги пацієнта: «{symptoms}»"
+    if summary: first += f"\n\nРаніше пацієнт уточнив: {summary}"
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": first}]
+    for turn in turns:
+        if turn["question"]: messages.append({"role": "assistant", "content": turn["question"]})
+        messages.append({"role": "user", "content": turn["answer"]})
+    if final: messages[-1]["content"] += "\n\n(Уточнень достатньо — дай остаточний аналіз без нових питань.)"
+    return messages
+
+
+def build_messages(conversation: dict, profile_text: str, emergency_text: str = "", budget: int = PROMPT_TOKEN_BUDGET):
+    """Повідомлення для chat.completions і кількість токенів промпту.
+
+    Останні RECENT_TURNS уточнень ідуть повними репліками, старіші згортаються в підсумок у першому повідомленні.
+    Якщо бюджет перевищено, в підсумок переходять і новіші уточнення (крім останнього), потім обрізається
+    підсумок і насамкінець — опис скарг. Системний промпт не змінюється ніколи.
+    """
+    answered = [turn for turn in conversation["turns"] if turn["answer"]]
+    split, symptoms, summary_limit = max(0, len(answered) - RECENT_TURNS), conversation["symptoms"], None
+    final = len(answered) >= MAX_CLARIFICATIONS
+    while True:
+        summary = _summary(answered[:split], summary_limit)
+        messages = _assemble(profile_text, emergency_text, symptoms, summary, answered[split:], final)
+        excess = count_messages(messages) - budget
+        if excess <= 0: break
+        if split < len(answered) - 1: split += 1
+        elif summary: summary_limit = count_tokens(summary) - excess
+        elif count_tokens(symptoms) > MIN_SYMPTOMS_TOKENS: symptoms = truncate(symptoms, max(MIN_SYMPTOMS_TOKENS, count_tokens(symptoms) - excess))
+        else: break  # далі різати нічого — краще трохи перевищити бюджет, ніж втратити останню відповідь
+    return messages, count_messages(messages)
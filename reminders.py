@@ -0,0 +1,96 @@
+# reminders.py — персистентні слоти нагадувань про ліки
+
+import asyncio
+import datetime
+import logging
+import re
+import sqlite3
+import time
+
+import metrics
+from database import Database
+from scheduler import next_run_after, parse_hhmm
+
+# Пропущені під час простою нагадування надсилаються, якщо запізнення не більше цього вікна
+CATCHUP_WINDOW = 6 * 3600
+# Найдовший сон циклу: слоти, додані іншим процесом (воркер без lease), notify() не будить —
+# їх підхоплює наступне опитування MIN(next_due)
+POLL_INTERVAL = 30
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS reminder_slots (slot_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, med_id INTEGER, minute_of_day INTEGER, next_due INTEGER, FOREIGN KEY (med_id) REFERENCES medications(med_id))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminder_slots_next_due ON reminder_slots (next_due)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminder_slots_med ON reminder_slots (med_id)")
+    # Одноразове перенесення розкладів, створених до появи таблиці слотів
+    if conn.execute("SELECT 1 FROM reminder_slots LIMIT 1").fetchone() is None:
+        for user_id, med_id, schedule_str in conn.execute("SELECT user_id, med_id, schedule FROM medications WHERE is_active = 1").fetchall():
+            insert_slots(conn, user_id, med_id, schedule_str)
+
+
+def insert_slots(conn: sqlite3.Connection, user_id: int, med_id: int, schedule_str: str):
+    now, rows = datetime.datetime.now(), []
+    for t in set(re.findall(r"(\d{2}:\d{2})", schedule_str or "")):
+        try: hour, minute = parse_hhmm(t)
+        except ValueError:
+            logging.warning(f"Некоректний час '{t}' у розкладі ліків med_id={med_id}")
+            continue
+        rows.append((user_id, med_id, hour * 60 + minute, int(next_run_after(hour, minute, None, now).timestamp())))
+    conn.executemany("INSERT INTO reminder_slots (user_id, med_id, minute_of_day, next_due) VALUES (?, ?, ?, ?)", rows)
+
+
+def delete_slots(conn: sqlite3.Connection, med_id: int):
+    conn.execute("DELETE FROM reminder_slots WHERE med_id = ?", (med_id,))
+
+
+class ReminderSlots:
+    """Цикл нагадувань поверх індексу reminder_slots(next_due).
+
+    У пам'яті нічого не завантажується: цикл вибирає лише прострочені слоти,
+    пересуває їм next_due на наступну добу і спить до MIN(next_due), але не довше poll_interval.
+    on_due(user_id, med_id, med_name, dosage, late_seconds) викликається для кожного слоту.
+    """
+
+    def __init__(self, db: Database, on_due, catchup_window: int = CATCHUP_WINDOW, batch_size: int = 500, poll_interval: float = POLL_INTERVAL):
+        self.db = db
+        self.on_due = on_due
+        self.catchup_window = catchup_window
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        """Будить цикл цього процесу після додавання нових слотів (вони можуть бути раніше поточного сну)."""
+        self._wakeup.set()
+
+    async def _process_due(self, now: float) -> int:
+        due = await self.db.fetchall("SELECT s.slot_id, s.user_id, s.med_id, s.minute_of_day, s.next_due, m.med_name, m.dosage, m.is_active FROM reminder_slots s JOIN medications m ON m.med_id = s.med_id WHERE s.next_due <= ? ORDER BY s.next_due LIMIT ?", (int(now), self.batch_size))
+        updates, stale = [], []
+        for slot_id, user_id, med_id, minute_of_day, next_due, med_name, dosage, is_active in due:
+            if not is_active:
+                stale.append((slot_id,))
+                continue
+            late = now - next_due
+            metrics.reminder_lateness.observe(max(late, 0))
+            metrics.reminder_last_lateness.set(late, kind="medication")
+            if late <= self.catchup_window: await self.on_due(user_id, med_id, med_name, dosage, late)
+            else: logging.info(f"Пропущене нагадування med_id={med_id} застаріло ({late / 3600:.1f} год), не надсилаємо")
+            next_due = next_run_after(minute_of_day // 60, minute_of_day % 60, None, datetime.datetime.fromtimestamp(now))
+            updates.append((int(next_due.timestamp()), slot_id))
+        if updates: await self.db.executemany("UPDATE reminder_slots SET next_due = ? WHERE slot_id = ?", updates)
+        if stale: await self.db.executemany("DELETE FROM reminder_slots WHERE slot_id = ?", stale)
+        return len(due)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            try:
+                if await self._process_due(now): continue
+                next_due = (await self.db.fetchone("SELECT MIN(next_due) FROM reminder_slots"))[0]
+            except Exception:
+                logging.exception("Помилка циклу нагадувань:")
+                next_due = now + 60
+            timeout = self.poll_interval if next_due is None else min(max(next_due - now, 0), self.poll_interval)
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError: pass
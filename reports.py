@@ -0,0 +1,94 @@
+# reports.py — рендеринг PDF-звітів у пулі процесів
+
+import copy
+import datetime
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DejaVuSans.ttf')
+REPORT_WORKERS = 2
+
+# Кеш шрифту в межах процесу-воркера: сирі байти файлу і розібраний прототип TTFFont
+_font_bytes = None
+_font_prototype = None
+
+
+# fpdf, fontTools і matplotlib імпортуються лише в процесах пулу — головний процес їх не завантажує
+def _init_worker():
+    global _font_bytes, _font_prototype
+    from fpdf import FPDF
+    with open(FONT_PATH, 'rb') as f: _font_bytes = f.read()
+    pdf = FPDF()
+    pdf.add_font('DejaVu', '', FONT_PATH)
+    _font_prototype = pdf.fonts['dejavu']
+
+
+def _add_cached_font(pdf):
+    # Метрики й cmap прототипу лише читаються, тож їх можна ділити між документами.
+    # ttfont і subset змінюються під час pdf.output(), тому для кожного документа вони свої.
+    if _font_prototype is None: return pdf.add_font('DejaVu', '', FONT_PATH)
+    from fpdf.fonts import SubsetMap
+    from fontTools import ttLib
+    font = copy.copy(_font_prototype)
+    font.i = len(pdf.fonts) + 1
+    font.ttfont = ttLib.TTFont(io.BytesIO(_font_bytes), recalcTimestamp=False, fontNumber=0, lazy=True)
+    font.missing_glyphs = []
+    font.subset = SubsetMap(font)
+    pdf.fonts[font.fontkey] = font
+
+
+def render_doctor_report(profile, history, generated_on: datetime.date, chart_png: bytes = None) -> bytes:
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.add_page()
+    _add_cached_font(pdf)
+    pdf.set_font('DejaVu', '', 16)
+    pdf.cell(0, 10, 'Звіт про стан здоров\'я', 0, 1, 'C')
+    pdf.set_font('DejaVu', '', 12)
+    pdf.cell(0, 10, f'Пацієнт: {profile[0] if profile else "N/A"}', 0, 1, 'C')
+    pdf.cell(0, 10, f'Дата генерації: {generated_on.strftime("%d-%m-%Y")}', 0, 1, 'C'), pdf.ln(10)
+    if chart_png: pdf.image(io.BytesIO(chart_png), w=pdf.epw), pdf.ln(5)
+    pdf.set_font('DejaVu', '', 14), pdf.cell(0, 10, 'Останні записи:', 0, 1), pdf.set_font('DejaVu', '', 10)
+    for record in history:
+        timestamp, mood, sleep, note, activity, stress, water = record
+        dt_object = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+        line = f"{dt_object.strftime('%d-%m-%y %H:%M')}: "
+        if note: line += f"Нотатка - {note}. "
+        if mood: line += f"Настрій - {mood}. "
+        if sleep: line += f"Сон - {sleep}. "
+        if activity: line += f"Активність - {activity}. "
+        if stress: line += f"Стрес - {stress}. "
+        if water: line += f"Вода - {water}. "
+        pdf.multi_cell(0, 5, line, new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+def warm_up():
+    """Завантажує важкі бібліотеки в процесі пулу заздалегідь, щоб перший звіт не чекав на імпорти."""
+    import numpy
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from fpdf import FPDF
+    return os.getpid()
+
+
+_pool = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: батьківський процес уже має потоки (пул БД), fork з ними небезпечний
+        _pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        logging.info("Пул рендерингу звітів зупинено.")
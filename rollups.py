@@ -0,0 +1,68 @@
+# rollups.py — попередньо агреговані денні та тижневі зрізи щоденника і прийому ліків
+
+import datetime
+import sqlite3
+
+# Варіанти з клавіатур check-in; довільний текст потрапляє в категорію OTHER, щоб зрізи не розростались
+CATEGORIES = {
+    "mood": ("😊 Чудовий", "😐 Нормальний", "😞 Поганий"),
+    "activity_level": ("Низька", "Середня", "Висока"),
+    "stress_level": ("Низький", "Середній", "Високий"),
+    "water_intake": ("Менше 1 літра", "1-2 літри", "Більше 2 літрів"),
+}
+OTHER = "інше"
+PERIODS = ("day", "week")
+
+# Однаковий текст для всіх інкрементів: у WriteBehindQueue вони зливаються в один executemany
+UPSERT_SQL = ("INSERT INTO health_rollups (user_id, period, period_start, metric, value, count) VALUES (?, ?, ?, ?, ?, 1) "
+              "ON CONFLICT (user_id, period, period_start, metric, value) DO UPDATE SET count = count + 1")
+
+
+def create_schema(conn: sqlite3.Connection):
+    # metric: entries | note | mood | activity_level | stress_level | water_intake | medication (value = taken/skipped)
+    conn.execute("""CREATE TABLE IF NOT EXISTS health_rollups (user_id INTEGER, period TEXT, period_start DATE, metric TEXT, value TEXT, count INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, period, period_start, metric, value)) WITHOUT ROWID""")
+
+
+def category(metric: str, value: str) -> str:
+    return value if value in CATEGORIES[metric] else OTHER
+
+
+def period_starts(day: datetime.date):
+    # day — локальна дата (як date.today() у тижневих звітах), хоч health_entries.timestamp зберігається в UTC
+    return (("day", day.isoformat()), ("week", (day - datetime.timedelta(days=day.weekday())).isoformat()))
+
+
+def entry_increments(user_id: int, day: datetime.date, fields: dict) -> list:
+    """Параметри UPSERT_SQL для одного запису health_entries."""
+    metrics = [("entries", "")] + [(metric, category(metric, fields[metric])) for metric in CATEGORIES if fields.get(metric)]
+    if fields.get("note"): metrics.append(("note", ""))
+    return [(user_id, period, start, metric, value) for period, start in period_starts(day) for metric, value in metrics]
+
+
+def medication_increments(user_id: int, day: datetime.date, status: str) -> list:
+    return [(user_id, period, start, "medication", status) for period, start in period_starts(day)]
+
+
+def backfill(conn: sqlite3.Connection):
+    """Перебудовує зрізи з сирих таблиць (для баз, що існували до появи health_rollups)."""
+    conn.execute("DELETE FROM health_rollups")
+    # Зрізи — за локальними днями: health_entries зберігає UTC і переводиться в localtime, medication_log уже локальний
+    starts = {"day": "date(timestamp{})", "week": "date(timestamp{}, 'weekday 0', '-6 days')"}
+    for period, start in starts.items():
+        entry_start, med_start = start.format(", 'localtime'"), start.format("")
+        conn.execute(f"INSERT INTO health_rollups SELECT user_id, '{period}', {entry_start}, 'entries', '', COUNT(*) FROM health_entries GROUP BY 1, 3")
+        conn.execute(f"INSERT INTO health_rollups SELECT user_id, '{period}', {entry_start}, 'note', '', COUNT(*) FROM health_entries WHERE note IS NOT NULL AND note != '' GROUP BY 1, 3")
+        for metric, options in CATEGORIES.items():
+            value = f"CASE WHEN {metric} IN ({', '.join('?' * len(options))}) THEN {metric} ELSE '{OTHER}' END"
+            conn.execute(f"INSERT INTO health_rollups SELECT user_id, '{period}', {entry_start}, '{metric}', {value}, COUNT(*) FROM health_entries WHERE {metric} IS NOT NULL AND {metric} != '' GROUP BY 1, 3, 5", options)
+        conn.execute(f"INSERT INTO health_rollups SELECT user_id, '{period}', {med_start}, 'medication', status, COUNT(*) FROM medication_log WHERE status IS NOT NULL GROUP BY 1, 3, 5")
+
+
+def fetch(conn: sqlite3.Connection, user_ids, period: str, since: str, until: str = None) -> list:
+    """Рядки (user_id, period_start, metric, value, count) для групи користувачів за період [since, until)."""
+    user_ids = list(user_ids)
+    sql = f"SELECT user_id, period_start, metric, value, count FROM health_rollups WHERE period = ? AND user_id IN ({', '.join('?' * len(user_ids))}) AND period_start >= ?"
+    params = [period, *user_ids, since]
+    if until: sql, params = sql + " AND period_start < ?", params + [until]
+    return conn.execute(sql + " ORDER BY user_id, period_start", params).fetchall()
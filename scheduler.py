@@ -0,0 +1,96 @@
+# scheduler.py — планувальник нагадувань на asyncio з мін-купою
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+import metrics
+
+# Максимальний сон між перевірками — захист від переведення системного годинника
+MAX_SLEEP = 3600
+
+
+class _Job:
+    __slots__ = ("key", "hour", "minute", "weekday", "callback", "next_run", "cancelled")
+
+    def __init__(self, key, hour, minute, weekday, callback):
+        self.key, self.hour, self.minute, self.weekday, self.callback = key, hour, minute, weekday, callback
+        self.next_run, self.cancelled = 0.0, False
+
+
+def next_run_after(hour: int, minute: int, weekday, now: datetime.datetime) -> datetime.datetime:
+    """Найближчий момент HH:MM (щодня або в заданий день тижня, 0 = понеділок) строго після now."""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if weekday is None:
+        if candidate <= now: candidate += datetime.timedelta(days=1)
+    else:
+        candidate += datetime.timedelta(days=(weekday - now.weekday()) % 7)
+        if candidate <= now: candidate += datetime.timedelta(days=7)
+    return candidate
+
+
+def parse_hhmm(at: str):
+    parsed = datetime.datetime.strptime(at.strip(), "%H:%M")
+    return parsed.hour, parsed.minute
+
+
+class ReminderScheduler:
+    """Щоденні/щотижневі завдання в купі за часом наступного запуску.
+
+    Додавання і видалення — O(log n) для окремого завдання, без перебудови всього розкладу.
+    Цикл run() спить рівно до найближчого завдання.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+
+    def add(self, key, at: str, callback, weekday: int = None):
+        """Реєструє callback() (корутинну функцію) на час at у форматі HH:MM. Кидає ValueError для некоректного часу."""
+        hour, minute = parse_hhmm(at)
+        self.remove(key)
+        job = _Job(key, hour, minute, weekday, callback)
+        job.next_run = next_run_after(hour, minute, weekday, datetime.datetime.now()).timestamp()
+        self._jobs[key] = job
+        self._push(job)
+
+    def remove(self, key):
+        if (job := self._jobs.pop(key, None)) is None: return
+        job.cancelled = True  # запис у купі буде відкинуто ліниво
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        if self._heap[0][2] is job: self._wakeup.set()  # нове найближче завдання — перераховуємо сон
+
+    def _fire(self, job: _Job, now: float):
+        lateness = now - job.next_run
+        metrics.reminder_last_lateness.set(lateness, kind=job.key)
+        if lateness > 60: logging.warning(f"Завдання {job.key} запущено із запізненням {lateness:.0f} с")
+        job.next_run = next_run_after(job.hour, job.minute, job.weekday, datetime.datetime.fromtimestamp(now)).timestamp()
+        self._push(job)
+        task = asyncio.create_task(job.callback())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        try:
+            while True:
+                while self._heap and self._heap[0][2].cancelled: heapq.heappop(self._heap)
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    self._fire(heapq.heappop(self._heap)[2], now)
+                    continue
+                timeout = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else MAX_SLEEP
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError: pass
+        finally:
+            # Запущені завдання (напр. тижнева розсилка) не переживають цикл: інакше після втрати lease відправників два
+            for task in self._tasks: task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,128 @@
+# sender.py — черга розсилки з обмеженням швидкості під ліміти Telegram
+
+import asyncio
+import collections
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+# Ліміти Bot API: ~30 повідомлень/с загалом і ~1 повідомлення/с в один чат
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class MessageSender:
+    """Обмежена черга повідомлень з пулом воркерів.
+
+    Глобальний token bucket + мінімальний інтервал на чат, пауза всіх воркерів
+    на retry_after при флуд-контролі, обмежені повтори на місці (порядок у межах чату зберігається).
+    send() лише ставить повідомлення в чергу (і чекає, якщо черга повна).
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL, workers: int = 8, max_queue: int = 10000, max_retries: int = 3):
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bot = None
+        self._bucket = TokenBucket(rate)
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._chat_ready = {}
+        self._chats = {}
+        self._paused_until = 0.0
+        self._tasks = []
+        self._latencies = collections.deque(maxlen=1000)
+        self.sent = self.failed = self.retried = 0
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        await self._queue.put((chat_id, text, kwargs, time.monotonic()))
+
+    async def drain(self):
+        """Чекає, доки всі поставлені в чергу повідомлення (разом із повторами) буде оброблено."""
+        await self._queue.join()
+
+    async def stop(self, timeout: float = 10.0):
+        # Даємо черзі дорозсилатися, але не блокуємо зупинку бота назавжди
+        try: await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError: logging.warning(f"Зупинка розсилки: у черзі залишилось {self._queue.qsize()} повідомлень")
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logging.info(f"Статистика розсилки: {self.stats}")
+
+    async def _wait_for_chat(self, chat_id: int):
+        now = time.monotonic()
+        ready = max(now, self._chat_ready.get(chat_id, 0.0))
+        self._chat_ready[chat_id] = ready + self.per_chat_interval  # резервуємо слот до сну, щоб інші воркери не відправили в той самий чат
+        if len(self._chat_ready) > 10000:
+            self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+        if ready > now: await asyncio.sleep(ready - now)
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, enqueued_at = await self._queue.get()
+            # Замок чату береться одразу після get(), тож черговість повідомлень одного чату зберігається і при повторах
+            chat = self._chats.get(chat_id) or self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+            chat[1] += 1
+            try:
+                async with chat[0]: await self._deliver(chat_id, text, kwargs, enqueued_at)
+            finally:
+                chat[1] -= 1
+                if not chat[1]: del self._chats[chat_id]
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text, kwargs, enqueued_at):
+        # Повтори — на місці, а не в кінці черги: наступні повідомлення в цей чат не обганяють поточне
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._wait_for_chat(chat_id)
+                if (pause := self._paused_until - time.monotonic()) > 0: await asyncio.sleep(pause)
+                await self._bucket.acquire()
+                await self.bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                self._latencies.append(time.monotonic() - enqueued_at)
+                return
+            except TelegramRetryAfter as e:
+                error = e
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logging.warning(f"Флуд-контроль Telegram: пауза розсилки на {e.retry_after} с")
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                self.failed += 1
+                logging.error(f"Не вдалося надіслати повідомлення user_id={chat_id}: {e}")
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries: await asyncio.sleep(2 ** attempt)
+            if attempt < self.max_retries: self.retried += 1
+        self.failed += 1
+        logging.error(f"Не вдалося надіслати повідомлення user_id={chat_id} після {self.max_retries + 1} спроб: {error}")
+
+    @property
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        percentile = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+        return {"queue_depth": self._queue.qsize(), "sent": self.sent, "failed": self.failed, "retried": self.retried,
+                "latency_p50": percentile(0.5), "latency_p99": percentile(0.99)}
@@ -0,0 +1,196 @@
+# sharding.py — кілька процесів-воркерів з розподілом оновлень за user_id і lease на фонові задачі
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sqlite3
+import time
+
+from aiogram import Bot, Dispatcher
+
+from database import Database
+
+LEASE_TTL = 30
+# Максимальна пауза перед перезапуском задачі під lease, що падає раз у раз
+RESTART_BACKOFF_MAX = 300
+WORKER_QUEUE_SIZE = 1000
+# Ідентифікатор власника lease: унікальний для процесу навіть за кількох контейнерів з однією БД
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# --- LEASE ---
+def create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+
+
+def _acquire_lease(conn: sqlite3.Connection, name: str, owner: str, ttl: float) -> bool:
+    now = time.time()
+    # Забираємо lease, якщо він вільний, прострочений або вже наш (тоді це продовження)
+    conn.execute("""INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                    WHERE leases.owner = excluded.owner OR leases.expires_at < ?""", (name, owner, now + ttl, now))
+    return conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()[0] == owner
+
+
+def _release_lease(conn: sqlite3.Connection, name: str, owner: str):
+    conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+async def _run_group(coros):
+    """Корутини як одна задача: падіння будь-якої або скасування зупиняє решту і дочікується їх."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception(): raise task.exception()
+    finally:
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _stop(task: asyncio.Future):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def hold_lease(db: Database, name: str, jobs, ttl: float = LEASE_TTL, owner: str = OWNER_ID):
+    """Виконує корутини з jobs() лише поки цей процес тримає lease `name`.
+
+    Інші процеси чекають і перехоплюють lease, якщо власник не продовжив його за ttl секунд
+    (впав або завис). При втраті lease всі корутини скасовуються і дочікуються, перш ніж lease
+    забере інший процес; падіння однієї зупиняє решту, і група перезапускається з наростаючою паузою.
+    """
+    task, failures, retry_at, started = None, 0, 0.0, 0.0
+    try:
+        while True:
+            try: owned = await db.run(_acquire_lease, name, owner, ttl, write=True)
+            except Exception:
+                logging.exception(f"Не вдалося оновити lease {name}:")
+                owned = False
+            if owned and task is None and time.monotonic() >= retry_at:
+                logging.info(f"Процес {owner} отримав lease {name}")
+                task, started = asyncio.ensure_future(_run_group(jobs())), time.monotonic()
+            elif not owned and task is not None:
+                logging.warning(f"Процес {owner} втратив lease {name}, зупиняємо задачу")
+                await _stop(task)
+                task = None
+            if task is not None and task.done():
+                if not task.cancelled() and task.exception():
+                    # Лічильник падінь скидається, якщо група пропрацювала довше за максимальну паузу
+                    failures = failures + 1 if time.monotonic() - started < RESTART_BACKOFF_MAX else 1
+                    delay = min(ttl / 3 * 2 ** (failures - 1), RESTART_BACKOFF_MAX)
+                    logging.error(f"Задача {name} впала, перезапуск через {delay:.0f} с:", exc_info=task.exception())
+                    retry_at = time.monotonic() + delay
+                task = None
+            await asyncio.sleep(ttl / 3)
+    finally:
+        if task is not None: await _stop(task)
+        try: await db.run(_release_lease, name, owner, write=True)
+        except Exception: pass  # БД вже могла бути закрита; lease просто сплине за ttl
+
+
+# --- МАРШРУТИЗАЦІЯ ---
+def update_user_id(update: dict) -> int:
+    """user_id автора оновлення (або id чату для оновлень без автора)."""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict): continue
+        for field in ("from", "user", "chat"):
+            if isinstance(source := event.get(field), dict) and "id" in source: return source["id"]
+    return 0
+
+
+def shard_for(update: dict, shards: int) -> int:
+    # Усі оновлення одного користувача потрапляють в один процес: FSM-кеш і порядок обробки залишаються локальними
+    return update_user_id(update) % shards
+
+
+# --- ВОРКЕР ---
+async def consume(dp: Dispatcher, bot: Bot, updates: multiprocessing.Queue, drain_timeout: float = 30.0, **kwargs):
+    """Обробляє оновлення з черги супервізора, доки не прийде None або не зникне батьківський процес."""
+    # Сигнали зупинки обробляє супервізор і надсилає None; самостійно воркер не зупиняється
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent = os.getppid()
+    loop = asyncio.get_running_loop()
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data, **kwargs}
+    tasks = set()
+
+    def get():
+        try: return updates.get(timeout=1.0)
+        except queue.Empty: return ...
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        while True:
+            update = await loop.run_in_executor(None, get)
+            if update is None: break
+            if update is ...:
+                if os.getppid() != parent: break  # супервізор зник без сигналу
+                continue
+            task = asyncio.create_task(dp.feed_raw_update(bot, update, **kwargs))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=drain_timeout)
+            if pending: logging.warning(f"{len(pending)} обробників не завершились за {drain_timeout} с")
+    finally:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+
+
+# --- СУПЕРВІЗОР ---
+class Supervisor:
+    """Запускає `shards` процесів target(index, shards, queue) і розкладає оновлення по їхніх чергах.
+
+    Впалий воркер перезапускається з тією ж чергою, тож його користувачі не переїжджають в інші процеси.
+    """
+
+    def __init__(self, target, shards: int, queue_size: int = WORKER_QUEUE_SIZE):
+        self.target = target
+        self.shards = shards
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(queue_size) for _ in range(shards)]
+        self.processes = [None] * shards
+        self._stopping = False
+        self.routed = [0] * shards
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=self.target, args=(index, self.shards, self.queues[index]), name=f"worker-{index}", daemon=False)
+        process.start()
+        self.processes[index] = process
+        logging.info(f"Запущено воркер {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.shards): self._spawn(index)
+
+    async def dispatch(self, update: dict):
+        index = shard_for(update, self.shards)
+        self.routed[index] += 1
+        try: self.queues[index].put_nowait(update)
+        except queue.Full:
+            # Воркер не встигає — пригальмовуємо прийом оновлень замість того, щоб їх губити
+            await asyncio.get_running_loop().run_in_executor(None, self.queues[index].put, update)
+
+    async def watch(self, interval: float = 1.0):
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logging.error(f"Воркер {index} завершився з кодом {process.exitcode}, перезапускаємо")
+                    self._spawn(index)
+            await asyncio.sleep(interval)
+
+    async def stop(self, timeout: float = 30.0):
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for q in self.queues: await loop.run_in_executor(None, q.put, None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(f"Воркер {index} не зупинився вчасно, завершуємо примусово")
+                process.terminate()
+        logging.info(f"Розподіл оновлень по воркерах: {self.routed}")
@@ -0,0 +1,30 @@
+# startup.py — вимірювання часу запуску: імпорти, фази старту, час до першого оновлення
+
+import logging
+import time
+from contextlib import contextmanager
+
+STARTED_AT = time.perf_counter()
+timings = []
+_first_update_seen = False
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try: yield
+    finally: timings.append((name, time.perf_counter() - started))
+
+
+def report():
+    details = ", ".join(f"{name}: {duration * 1000:.0f} мс" for name, duration in timings)
+    logging.info(f"Час запуску {time.perf_counter() - STARTED_AT:.2f} с ({details})")
+
+
+async def first_update_middleware(handler, event, data):
+    """Outer-middleware на update: один раз логує час від старту процесу до першого оновлення."""
+    global _first_update_seen
+    if not _first_update_seen:
+        _first_update_seen = True
+        logging.info(f"Перше оновлення отримано через {time.perf_counter() - STARTED_AT:.2f} с після запуску")
+    return await handler(event, data)
@@ -0,0 +1,82 @@
+# streaming.py — поступовий вивід потокової відповіді AI в одне повідомлення Telegram
+
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+# Telegram обмежує частоту редагувань; частіше ніж раз на секунду в один чат редагувати не варто
+EDIT_INTERVAL = 1.0
+# Запас від ліміту 4096 символів на повідомлення
+MAX_MESSAGE_LENGTH = 4000
+CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Повідомлення, яке дописується в міру надходження токенів.
+
+    Проміжні редагування йдуть без parse_mode (незакритий тег чи сутність зламали б HTML),
+    фінальне — з типовим режимом бота, а якщо текст моделі не розбирається як HTML — без розмітки.
+    Якщо текст перевищує ліміт, починається нове повідомлення.
+    """
+
+    def __init__(self, message: Message, interval: float = EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        self._sent = None
+        self._offset = 0
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def _show(self, text: str, final: bool = False, plain: bool = False):
+        if text == self._shown: return
+        kwargs = {"parse_mode": None} if plain or not final else {}
+        try:
+            if self._sent is None: self._sent = await self.message.answer(text, **kwargs)
+            else: await self._sent.edit_text(text, **kwargs)
+            self._shown = text
+        except TelegramRetryAfter as e:
+            if final: raise
+            self._last_edit = time.monotonic() + e.retry_after  # пропускаємо проміжні редагування до кінця паузи
+        except TelegramBadRequest as e:
+            # «<5 днів», «AT&T» у відповіді — не HTML; інакше лишився б проміжний текст із курсором
+            if final and not plain and "can't parse entities" in str(e): return await self._show(text, final=True, plain=True)
+            if "not modified" not in str(e): logging.warning(f"Не вдалося оновити потокову відповідь: {e}")
+
+    async def feed(self, delta: str):
+        self.text += delta
+        if len(self.text) - self._offset > MAX_MESSAGE_LENGTH:
+            # Закриваємо поточне повідомлення на межі рядка і продовжуємо в новому
+            cut = self.text.rfind("\n", self._offset, self._offset + MAX_MESSAGE_LENGTH)
+            cut = cut if cut > self._offset else self._offset + MAX_MESSAGE_LENGTH
+            await self._show(self.text[self._offset:cut], final=True)
+            self._sent, self._shown, self._offset = None, "", cut
+        if time.monotonic() - self._last_edit >= self.interval:
+            self._last_edit = time.monotonic()
+            await self._show(self.text[self._offset:] + CURSOR)
+
+    async def abort(self):
+        if self.text[self._offset:]: await self._show(self.text[self._offset:] + "\n\n⚠️ Відповідь перервано.", final=True)
+
+    async def finish(self) -> str:
+        if self.text[self._offset:]: await self._show(self.text[self._offset:], final=True)
+        return self.text
+
+
+async def stream_to_message(message: Message, stream) -> str:
+    """Споживає потік chat.completions (stream=True) і повертає повний текст відповіді."""
+    reply = StreamingReply(message)
+    try:
+        async for chunk in stream:
+            if chunk.choices and (delta := chunk.choices[0].delta.content): await reply.feed(delta)
+    except (Exception, asyncio.CancelledError):
+        # Частково показану відповідь позначаємо, повторна спроба почне нове повідомлення
+        await reply.abort()
+        raise
+    finally:
+        # Перерваний дедлайном чи помилкою потік інакше тримає HTTP-з'єднання пулу до збирання сміття
+        await stream.close()
+    return await reply.finish()
@@ -0,0 +1,27 @@
+# Сторінка історії вміщується в одне повідомлення Telegram за будь-якого вмісту записів
+
+import asyncio
+import re
+
+import med_bot_aiogram as bot
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+def _render(monkeypatch, rows):
+    async def get_history_page(*args, **kwargs): return rows
+    monkeypatch.setattr(bot, "get_history_page", get_history_page)
+    return asyncio.run(bot.render_history_page(1))[0]
+
+
+def test_oversized_checkin_field_is_clipped(monkeypatch):
+    huge = "<&>" * 3000  # кожен символ після екранування довший у 4-5 разів
+    text = _render(monkeypatch, [(1, "2024-05-01 10:00:00", huge, huge, None, huge, huge, huge)])
+    assert len(text) <= TELEGRAM_TEXT_LIMIT
+    assert "…" in text
+    assert not re.search(r"&[a-z]*…", text)  # сутність не розірвана обрізанням
+
+
+def test_page_of_oversized_entries_fits(monkeypatch):
+    rows = [(i, f"2024-05-{i + 1:02d} 10:00:00", "x" * 5000, "&" * 5000, "n" * 5000, "y" * 5000, "z" * 5000, "w" * 5000) for i in range(bot.HISTORY_PAGE_SIZE)]
+    assert len(_render(monkeypatch, rows)) <= TELEGRAM_TEXT_LIMIT
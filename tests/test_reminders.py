@@ -0,0 +1,45 @@
+# Нагадування, додані іншим процесом, доставляються без notify() від власника lease
+
+import asyncio
+import sqlite3
+import time
+
+import reminders
+from database import Database
+
+
+def _schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE medications (med_id INTEGER PRIMARY KEY, user_id INTEGER, med_name TEXT, dosage TEXT, schedule TEXT, is_active INTEGER)")
+    reminders.create_schema(conn)
+
+
+def _add_slot(conn: sqlite3.Connection, next_due: int):
+    conn.execute("INSERT INTO medications VALUES (1, 7, 'Аспірин', '1 таблетка', '', 1)")
+    conn.execute("INSERT INTO reminder_slots (user_id, med_id, minute_of_day, next_due) VALUES (7, 1, 0, ?)", (next_due,))
+
+
+def test_slot_from_other_instance_is_delivered_on_time(tmp_path):
+    async def main():
+        path = str(tmp_path / "bot.db")
+        owner, worker = Database(path), Database(path)
+        await owner.run(_schema, write=True)
+        delivered = []
+
+        async def on_due(user_id, med_id, med_name, dosage, late):
+            delivered.append((user_id, med_id, late, time.time()))
+
+        slots = reminders.ReminderSlots(owner, on_due, poll_interval=0.3)
+        loop_task = asyncio.create_task(slots.run())
+        await asyncio.sleep(0.1)  # цикл власника заснув на порожній таблиці
+        due = int(time.time()) + 1
+        await worker.run(_add_slot, due, write=True)  # слот іншого воркера: notify() власника не викликається
+        try:
+            while not delivered and time.time() < due + 5: await asyncio.sleep(0.05)
+        finally:
+            loop_task.cancel()
+            await asyncio.gather(loop_task, return_exceptions=True)
+            owner.close(), worker.close()
+        assert delivered and delivered[0][:2] == (7, 1)
+        assert delivered[0][3] - due < 1.0
+
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# webhook_server.py — режим webhook на aiohttp як альтернатива long polling
+
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Обробник webhook, який при зупинці дочікується оновлень, що вже обробляються у фоні."""
+
+    def __init__(self, *args, drain_timeout: float = 30.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def drain(self, app: web.Application = None):
+        if not (tasks := set(self._background_feed_update_tasks)): return
+        logging.info(f"Очікуємо завершення {len(tasks)} обробників перед зупинкою...")
+        _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if pending: logging.warning(f"{len(pending)} обробників не завершились за {self.drain_timeout} с")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, base_url: str, path: str, secret_token: str = None, host: str = "0.0.0.0", port: int = 8080,
+                      drop_pending_updates: bool = False, drain_timeout: float = 30.0):
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token, drain_timeout=drain_timeout)
+    # Порядок on_shutdown важливий: спершу дочікуємось обробників, потім shutdown диспетчера (FSM, БД), і лише тоді закриваємо сесію бота
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=path)
+
+    async def set_webhook():
+        await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret_token, allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=drop_pending_updates)
+        logging.info(f"Webhook встановлено на {base_url.rstrip('/')}{path}")
+    dp.startup.register(set_webhook)
+
+    await _serve(app, host, port, path)
+
+
+async def run_webhook_proxy(bot: Bot, dispatch, base_url: str, path: str, allowed_updates, secret_token: str = None, host: str = "0.0.0.0", port: int = 8080,
+                            drop_pending_updates: bool = False):
+    """Webhook для режиму з кількома воркерами: оновлення лише перевіряються і передаються в dispatch(update: dict)."""
+    async def handle(request: web.Request):
+        if secret_token and not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        await dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret_token, allowed_updates=allowed_updates, drop_pending_updates=drop_pending_updates)
+    await _serve(app, host, port, path)
+
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: pass  # Windows
+    await stop.wait()
+
+
+async def _serve(app: web.Application, host: str, port: int, path: str):
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Webhook-сервер слухає {host}:{port}{path}")
+    try: await wait_for_stop_signal()
+    finally:
+        # Спочатку сайт перестає приймати з'єднання, далі виконуються on_shutdown у порядку реєстрації
+        await runner.cleanup()
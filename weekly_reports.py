@@ -0,0 +1,95 @@
+# weekly_reports.py — тижневий дайджест: користувачі порціями, зведення одним запитом на порцію, відновлення після збою
+
+import datetime
+import html
+import logging
+import sqlite3
+
+import rollups
+from database import Database
+from sender import MessageSender
+
+WEEKLY_CHUNK_SIZE = 500
+
+
+def create_schema(conn: sqlite3.Connection):
+    # Прогрес розсилки за тиждень: last_user_id — останній користувач порції, яку вже віддано Telegram
+    conn.execute("CREATE TABLE IF NOT EXISTS weekly_report_runs (week_start DATE PRIMARY KEY, last_user_id INTEGER DEFAULT 0, sent INTEGER DEFAULT 0, started_at DATETIME DEFAULT CURRENT_TIMESTAMP, finished_at DATETIME)")
+
+
+def week_start(day: datetime.date) -> datetime.date:
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def _load_chunk(conn: sqlite3.Connection, week: datetime.date, after_user_id: int, limit: int):
+    """Порція користувачів і всі дані для їхніх зведень — фіксована кількість запитів незалежно від розміру порції."""
+    users = conn.execute("SELECT user_id, first_name, checkin_streak, last_checkin_date FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after_user_id, limit)).fetchall()
+    if not users: return [], {}, {}, {}
+    ids = [row[0] for row in users]
+    placeholders = ", ".join("?" * len(ids))
+    start, end = week.isoformat(), (week + datetime.timedelta(days=7)).isoformat()
+    weekly = {}
+    for user_id, _, metric, value, count in rollups.fetch(conn, ids, "week", start, end):
+        weekly.setdefault(user_id, {})[(metric, value)] = count
+    # Днем check-in вважається день із рядком mood: його пише лише check-in, а не швидкі нотатки; значень настрою за день може бути кілька
+    checkin_days = dict(conn.execute(f"SELECT user_id, COUNT(DISTINCT period_start) FROM health_rollups WHERE period = 'day' AND metric = 'mood' AND user_id IN ({placeholders}) AND period_start >= ? AND period_start < ? GROUP BY user_id", (*ids, start, end)).fetchall())
+    open_cycles = dict(conn.execute(f"SELECT user_id, MAX(start_date) FROM cycles WHERE end_date IS NULL AND user_id IN ({placeholders}) GROUP BY user_id", ids).fetchall())
+    return users, weekly, checkin_days, open_cycles
+
+
+def format_summary(first_name, streak: int, checkin_days: int, counts: dict, cycle_start, today: datetime.date) -> str:
+    lines = [f"📊 <b>Ваш тиждень, {html.escape(first_name or 'друже')}</b>\n", f"☀️ Check-in: {checkin_days} з 7 днів"]
+    if streak > 1: lines.append(f"🔥 Серія: {streak} днів поспіль")
+    moods = sorted(((count, value) for (metric, value), count in counts.items() if metric == "mood" and value != rollups.OTHER), reverse=True)
+    if moods: lines.append(f"🙂 Найчастіший настрій: {moods[0][1]}")
+    taken, skipped = counts.get(("medication", "taken"), 0), counts.get(("medication", "skipped"), 0)
+    if taken + skipped: lines.append(f"💊 Прийом ліків: {taken} з {taken + skipped} ({round(100 * taken / (taken + skipped))}%)")
+    if notes := counts.get(("note", ""), 0): lines.append(f"📝 Нотаток: {notes}")
+    if cycle_start:
+        day = (today - datetime.date.fromisoformat(cycle_start)).days + 1
+        if 0 < day <= 60: lines.append(f"🌸 Поточний цикл: {day}-й день")
+    return "\n".join(lines)
+
+
+class WeeklyReportJob:
+    """Розсилка тижневих дайджестів з відновленням.
+
+    Користувачі читаються порціями за ключем user_id; після того як порцію фактично відправлено
+    (черга message_sender спорожніла), прогрес фіксується в weekly_report_runs. Після падіння
+    розсилка продовжується з наступної порції — повторно можуть прийти лише повідомлення незавершеної порції.
+    Користувачі без жодної активності за тиждень дайджест не отримують.
+    """
+
+    def __init__(self, db: Database, sender: MessageSender, chunk_size: int = WEEKLY_CHUNK_SIZE):
+        self.db = db
+        self.sender = sender
+        self.chunk_size = chunk_size
+
+    async def run(self, today: datetime.date = None):
+        today = today or datetime.date.today()
+        week = week_start(today)
+        await self.db.execute("INSERT OR IGNORE INTO weekly_report_runs (week_start) VALUES (?)", (week.isoformat(),))
+        row = await self.db.fetchone("SELECT last_user_id, sent, finished_at FROM weekly_report_runs WHERE week_start = ?", (week.isoformat(),))
+        last_user_id, sent, finished_at = row
+        if finished_at: return logging.info(f"Тижневі звіти за {week} вже розіслано")
+        if last_user_id: logging.info(f"Продовжуємо розсилку тижневих звітів за {week} після user_id={last_user_id}")
+        while True:
+            users, weekly, checkin_days, open_cycles = await self.db.run(_load_chunk, week, last_user_id, self.chunk_size)
+            if not users: break
+            for user_id, first_name, streak, last_checkin in users:
+                counts, days = weekly.get(user_id, {}), checkin_days.get(user_id, 0)
+                if not days and not counts: continue
+                # Серія, що обірвалась до вчора, вже не актуальна
+                if not last_checkin or (today - datetime.date.fromisoformat(last_checkin)).days > 1: streak = 0
+                await self.sender.send(user_id, format_summary(first_name, streak or 0, days, counts, open_cycles.get(user_id), today))
+                sent += 1
+            await self.sender.drain()
+            last_user_id = users[-1][0]
+            await self.db.execute("UPDATE weekly_report_runs SET last_user_id = ?, sent = ? WHERE week_start = ?", (last_user_id, sent, week.isoformat()))
+        await self.db.execute("UPDATE weekly_report_runs SET finished_at = CURRENT_TIMESTAMP WHERE week_start = ?", (week.isoformat(),))
+        logging.info(f"Тижневі звіти за {week} розіслано: {sent}")
+
+    async def resume(self):
+        """Дозавершує розсилку, перервану падінням процесу (викликається при отриманні lease планувальника)."""
+        row = await self.db.fetchone("SELECT week_start FROM weekly_report_runs WHERE finished_at IS NULL ORDER BY week_start DESC LIMIT 1")
+        if row and datetime.date.fromisoformat(row[0]) == week_start(datetime.date.today()): await self.run()